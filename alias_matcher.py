@@ -0,0 +1,156 @@
+import re
+import unicodedata
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+"""Normalized-token alias matching used to tag entity mentions in paragraphs."""
+
+# Normalizations applied to both aliases and paragraph tokens, so one alias covers its variants.
+#   quotes:     curly/prime apostrophes are treated as '
+#   possessive: Mattie's / Mattie’s -> mattie
+#   diacritics: Zoë -> zoe
+#   hyphens:    Mattie-Mae matches the alias "Mattie Mae" (and vice versa)
+#   plural:     Albrights -> albright
+ALL_NORMALIZATIONS = ("quotes", "possessive", "diacritics", "hyphens", "plural")
+DEFAULT_NORMALIZATIONS = ALL_NORMALIZATIONS
+
+QUOTE_CHARS = str.maketrans({"’": "'", "‘": "'", "ʼ": "'", "′": "'", "`": "'"})
+TOKEN_PATTERN = re.compile(r"\w+(?:['’‘ʼ′`]\w+)*")
+TOKEN_PATTERN_HYPHENATED = re.compile(r"\w+(?:['’‘ʼ′`-]\w+)*")
+# Whitespace or a hyphen may separate the tokens of a multi-word alias, plus any punctuation the alias
+# itself has between those tokens (the "." of "Dr. Watson", the "&" of "Marks & Spencer").
+TOKEN_GAP = re.compile(r"[\s-]+")
+
+# Normalizations kept when telling apart aliases of different entities that normalize alike
+# ("Albright" / "Albrights" under plural): these never turn one name into another.
+EXACT_NORMALIZATIONS = frozenset(("quotes", "possessive"))
+
+# Marks the end of an alias in the trie; holds the entity id.
+END = "\0"
+# Punctuation allowed in the gap before a node's token, collected from the aliases passing through it.
+GAP = "\1"
+# At the end of aliases of several entities that normalize alike: {exact form: entity id}, used instead of END.
+EXACT = "\2"
+
+
+def check_normalizations(normalizations: Iterable[str]) -> frozenset:
+    unknown = set(normalizations) - set(ALL_NORMALIZATIONS)
+    if unknown:
+        raise ValueError(f"Unknown normalizations: {', '.join(sorted(unknown))}")
+    return frozenset(normalizations)
+
+
+class AliasMatcher:
+    """
+    Token trie over normalized aliases. Aliases are normalized once at build time, each paragraph is
+    tokenized once, and matching walks the trie from every token taking the longest alias that fits.
+    """
+
+    def __init__(self, alias_map: Dict[str, str], normalizations: Iterable[str] = DEFAULT_NORMALIZATIONS):
+        self.normalizations = check_normalizations(normalizations)
+        self.trie: Dict = {}
+        ends = {}
+        for alias, eid in sorted(alias_map.items(), key=lambda x: -len(x[0])):  # longest first wins collisions
+            tokens = self.tokenize(alias)
+            if not tokens:
+                continue
+            node = self.trie
+            for k, (start, _, token) in enumerate(tokens):
+                node = node.setdefault(token, {})
+                if k:
+                    punctuation = TOKEN_GAP.sub("", alias[tokens[k - 1][1]:start])
+                    node[GAP] = "".join(sorted(set(node.get(GAP, "")) | set(punctuation)))
+            ends.setdefault(id(node), (node, []))[1].append((alias, eid))
+
+        for node, aliases in ends.values():
+            if len({eid for _, eid in aliases}) == 1:
+                node[END] = aliases[0][1]
+                continue
+            # Aliases of different entities normalize alike: only tag their exact forms
+            exact = node[EXACT] = {}
+            for alias, eid in aliases:
+                exact.setdefault(self.exact_form(alias), eid)
+            print(f"[!] Aliases {', '.join(repr(a) for a, _ in aliases)} of different entities normalize alike; "
+                  f"only their exact forms are tagged")
+
+    # Trie access; entity_registry.CompiledAliasMatcher walks flat arrays instead of nested dicts
+    def root(self):
+        return self.trie
+
+    def child(self, node, token: str):
+        return node.get(token)
+
+    def entity(self, node) -> Optional[str]:
+        return node.get(END)
+
+    def gap(self, node) -> str:
+        return node.get(GAP, "")
+
+    def exact_entities(self, node) -> Dict[str, str]:
+        return node.get(EXACT, {})
+
+    def gap_allowed(self, node, gap: str) -> bool:
+        """Check the text between two tokens: whitespace, hyphens and the node's alias punctuation only."""
+        if not gap:
+            return False
+        allowed = self.gap(node)
+        return all(c in allowed for c in TOKEN_GAP.sub("", gap))
+
+    def normalize_token(self, token: str, normalizations: Optional[frozenset] = None) -> str:
+        normalizations = self.normalizations if normalizations is None else normalizations
+        token = token.lower()
+        if "quotes" in normalizations:
+            token = token.translate(QUOTE_CHARS)
+        if "possessive" in normalizations and token.endswith("'s"):
+            token = token[:-2]
+        if "diacritics" in normalizations:
+            token = "".join(c for c in unicodedata.normalize("NFKD", token) if not unicodedata.combining(c))
+        if "plural" in normalizations and len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        return token
+
+    def exact_form(self, text: str) -> str:
+        """Lower-cased tokens with only the EXACT_NORMALIZATIONS applied, joined by single spaces."""
+        normalizations = self.normalizations & EXACT_NORMALIZATIONS
+        return " ".join(self.normalize_token(m.group(0), normalizations) for m in TOKEN_PATTERN.finditer(text))
+
+    def tokenize(self, text: str) -> List[Tuple[int, int, str]]:
+        """Split text into (start, end, normalized token) triples."""
+        pattern = TOKEN_PATTERN if "hyphens" in self.normalizations else TOKEN_PATTERN_HYPHENATED
+        return [(m.start(), m.end(), self.normalize_token(m.group(0))) for m in pattern.finditer(text)]
+
+    def find(self, text: str, tokens: Optional[List[Tuple[int, int, str]]] = None) -> List[Tuple[int, int, str]]:
+        """Return non-overlapping (start, end, entity id) matches, leftmost-longest."""
+        tokens = tokens if tokens is not None else self.tokenize(text)
+        matches = []
+        i = 0
+        while i < len(tokens):
+            node = self.root()
+            best = None
+            j = i
+            while j < len(tokens):
+                node = self.child(node, tokens[j][2])
+                if node is None:
+                    break
+                if j > i and not self.gap_allowed(node, text[tokens[j - 1][1]:tokens[j][0]]):
+                    break
+                eid = self.entity(node)
+                if eid is None:
+                    exact = self.exact_entities(node)
+                    if exact:
+                        eid = exact.get(self.exact_form(text[tokens[i][0]:tokens[j][1]]))
+                if eid is not None:
+                    best = (j, eid)
+                j += 1
+            if best:
+                end_index, eid = best
+                end = tokens[end_index][1]
+                # Keep a plural possessive apostrophe (the Albrights') inside the match
+                if ("possessive" in self.normalizations and text[end - 1:end] in ("s", "S")
+                        and text[end:end + 1] in ("'", "’")):
+                    end += 1
+                matches.append((tokens[i][0], end, eid))
+                i = end_index + 1
+            else:
+                i += 1
+        return matches
@@ -7,8 +7,9 @@ from langchain.output_parsers import PydanticOutputParser
 from pydantic import BaseModel, Field
 from typing import List
 from collections import defaultdict
-from itertools import islice
 import re
+from prompt_packer import get_budget, get_context_window, get_reserve, get_token_counter, pack_items
+from structured_output import llm_retry, parse_structured, report_stats
 
 ENTITY_TYPE_MAP = {
     "PERSON": "Character",
@@ -103,11 +104,6 @@ Input:
 Only return valid JSON. No explanation.
 """
 
-def batch(iterable, size):
-    it = iter(iterable)
-    while chunk := list(islice(it, size)):
-        yield chunk
-
 def deduplicate_aliases(entities):
     for ent in entities:
         if ent.get("aliases"):
@@ -190,25 +186,42 @@ def collect_global_entities(chapters):
                     })
     return output
 
-def canonicalize_entities_ollama(global_entities: dict, model="llama3.2", batch_size=10) -> list:
-    llm = ChatOllama(model=model, temperature=0, format='json') # OllamaLLM(model=model_name, temperature=0)
+def pack_entity_values(etype: str, values: list, budget: int, reserve: int, count_tokens) -> list:
+    """
+    Pack one type's values into requests that fit the prompt budget, and whose reply fits the reserved
+    output tokens: the model echoes every value back as a {type, canonical_name, aliases} object.
+    """
+    prompt = PromptTemplate.from_template(PROMPT_TEMPLATE)
+    format_instructions = PydanticOutputParser(pydantic_object=EntitiesList).get_format_instructions()
+    overhead = count_tokens(prompt.format(entity_input=f"{etype}: ", format_instructions=format_instructions))
+    envelope = count_tokens(json.dumps({"entities": []}))
+    reply = lambda value: count_tokens(json.dumps({"type": etype, "canonical_name": value, "aliases": [value]}, indent=2))
+    return pack_items(values, overhead, budget, count_tokens, output_tokens=reply, output_budget=reserve - envelope)
+
+def canonicalize_entities_ollama(global_entities: dict, model="llama3.2", context_tokens=None, reserve_tokens=None) -> list:
+    llm = ChatOllama(model=model, temperature=0, format='json', num_ctx=get_context_window(model, context_tokens)) # OllamaLLM(model=model_name, temperature=0)
     parser = PydanticOutputParser(pydantic_object=EntitiesList)
     prompt = PromptTemplate.from_template(PROMPT_TEMPLATE)
+    budget = get_budget(model, context_tokens, reserve_tokens)
+    reserve = get_reserve(model, context_tokens, reserve_tokens)
+    count_tokens = get_token_counter(model)
     grouped_by_type = defaultdict(list)
     deduped_entities = deduplicate_aliases(global_entities)
     for ent in deduped_entities:
         grouped_by_type[ent["type"]].append(ent["value"])
     results = []
     for etype, aliases in grouped_by_type.items():
-      print(f"[+] Processing {etype} ({len(aliases)} values)...")
-      for chunk in batch(aliases, batch_size):
+      chunks = pack_entity_values(etype, aliases, budget, reserve, count_tokens)
+      print(f"[+] Processing {etype} ({len(aliases)} values in {len(chunks)} requests)...")
+      for chunk in chunks:
         entity_input = f"{etype}: {', '.join(chunk)}"
         # print(f"[LLM] Canonicalizing {entity_input}")
         full_prompt = prompt.format(entity_input=entity_input, format_instructions=parser.get_format_instructions())
-        structured_llm = llm.with_structured_output(EntitiesList, method="json_schema")
+        structured_llm = llm.with_structured_output(EntitiesList, method="json_schema", include_raw=True)
         response = structured_llm.invoke(full_prompt)
-        dict_response = response.model_dump(mode="json")
-        results.extend(dict_response["entities"])
+        # Validate per entity and repair locally, re-requesting only entities that still fail
+        results.extend(parse_structured(response["raw"].content, EntityData, stage="canonicalize",
+                                        retry=llm_retry(llm), many=True, key="entities"))
     # print(f"[LLM] Canonicalized {len(results)} entities")
     merged = {}
     for ent in results:
@@ -225,13 +238,18 @@ def main():
     parser.add_argument("book_json", help="Path to JSON file containing chapters with spaCy entities.")
     parser.add_argument("--model", default="llama3.2", help="Ollama model to use.")
     parser.add_argument("--output", "-o", help="Optional path to save output JSON.")
+    parser.add_argument("--context-tokens", type=int, help="Override the model's context window (see prompt_packer.py).")
+    parser.add_argument("--reserve-tokens", type=int, help="Override the tokens reserved for the model's reply.")
+    parser.add_argument("--stats", help="Append structured-output failure/repair counters to this JSONL file.")
     args = parser.parse_args()
 
     data = json.loads(Path(args.book_json).read_text(encoding="utf-8"))
     chapters = data.get("chapters", [data])  # support full book or single chapter
     
     global_entities = collect_global_entities(chapters)
-    canonical = canonicalize_entities_ollama(global_entities, model=args.model, batch_size=10)
+    canonical = canonicalize_entities_ollama(global_entities, model=args.model,
+                                             context_tokens=args.context_tokens, reserve_tokens=args.reserve_tokens)
+    report_stats(args.stats)
     # print(canonical)
     enriched = assign_ids(canonical)
     deduped_enriched = deduplicate_aliases(enriched)   
@@ -0,0 +1,158 @@
+import re
+import json
+import argparse
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from alias_matcher import AliasMatcher, ALL_NORMALIZATIONS, DEFAULT_NORMALIZATIONS
+from entity_indexer import build_alias_lookup
+from prompt_packer import get_token_counter
+
+
+"""
+Merge and split book paragraphs into token-bounded, overlapping chunks for retrieval. Chunks never cut
+through an entity mention and keep character offsets back to their CH{n}_P{i} paragraphs.
+"""
+
+SENTENCE_BREAK = re.compile(r"(?<=[.!?…])[\"'”’)]*\s+")
+WORD_BREAK = re.compile(r"\s+")
+
+
+def safe_breaks(text: str, pattern: re.Pattern, spans: List[Tuple[int, int]]) -> List[int]:
+    """Offsets where text may be cut: ends of pattern matches that do not fall inside an entity span."""
+    return [m.end() for m in pattern.finditer(text) if not any(s < m.start() < e or s < m.end() < e for s, e in spans)]
+
+
+def split_paragraph(text: str, spans: List[Tuple[int, int]], max_tokens: int,
+                    count_tokens: Callable[[str], int]) -> List[Tuple[int, int]]:
+    """Split a paragraph into (start, end) segments of at most max_tokens, on sentence then word breaks."""
+    segments = []
+    cuts = [0] + safe_breaks(text, SENTENCE_BREAK, spans) + [len(text)]
+    for start, end in zip(cuts, cuts[1:]):
+        if start == end:
+            continue
+        if count_tokens(text[start:end]) <= max_tokens:
+            segments.append((start, end))
+            continue
+        # Sentence too long on its own: pack words, still never cutting an entity span
+        words = [start] + [start + b for b in safe_breaks(text[start:end], WORD_BREAK, [(s - start, e - start) for s, e in spans])] + [end]
+        seg_start = start
+        for prev, cut in zip(words[1:-1], words[2:]):
+            if count_tokens(text[seg_start:cut]) > max_tokens and prev > seg_start:
+                segments.append((seg_start, prev))
+                seg_start = prev
+        segments.append((seg_start, end))
+    return segments
+
+
+def tail_segment(seg: Dict, text: str, spans: List[Tuple[int, int]], max_tokens: int,
+                 count_tokens: Callable[[str], int]) -> Optional[Dict]:
+    """Return the longest end of a segment within max_tokens that starts at a safe word break, if any."""
+    best = None
+    for cut in reversed([seg["start"] + b for b in safe_breaks(text[seg["start"]:seg["end"]], WORD_BREAK,
+                                                               [(s - seg["start"], e - seg["start"]) for s, e in spans])]):
+        if cut >= seg["end"]:
+            continue
+        tokens = count_tokens(text[cut:seg["end"]])
+        if tokens > max_tokens:
+            break
+        best = {"paragraph": seg["paragraph"], "start": cut, "end": seg["end"], "tokens": tokens}
+    return best
+
+
+def chunk_text(segments: List[Dict], paragraphs: Dict[str, str]) -> Tuple[str, List[Tuple[str, int, int]]]:
+    """Join segments into chunk text, merging adjacent segments of the same paragraph into one span."""
+    parts = []
+    for seg in segments:
+        if parts and parts[-1][0] == seg["paragraph"] and parts[-1][2] == seg["start"]:
+            parts[-1] = (seg["paragraph"], parts[-1][1], seg["end"])
+        else:
+            parts.append((seg["paragraph"], seg["start"], seg["end"]))
+    return "\n\n".join(paragraphs[pid][s:e].strip() for pid, s, e in parts), parts
+
+
+def iter_chunks(book: Dict, count_tokens: Callable[[str], int], max_tokens: int = 512, overlap: int = 64,
+                matcher: AliasMatcher = None) -> Iterator[Dict]:
+    """
+    Yield chunks chapter by chapter. Paragraphs are packed together up to max_tokens and long ones are
+    split; each chunk after the first in a chapter repeats up to `overlap` tokens from the end of the previous.
+    """
+    if overlap >= max_tokens:
+        raise ValueError(f"Overlap ({overlap}) must be smaller than the chunk size ({max_tokens})")
+    for chapter in book.get("chapters", []):
+        cid = f"CH{chapter['number']}"
+        paragraphs = {f"{cid}_P{i}": p for i, p in enumerate(chapter.get("paragraphs", []))}
+        segments = []
+        spans = {}
+        for pid, text in paragraphs.items():
+            spans[pid] = [(s, e) for s, e, _ in matcher.find(text)] if matcher else []
+            # Segments leave room for the overlap, so it always fits in front of the next one
+            for start, end in split_paragraph(text, spans[pid], max_tokens - overlap, count_tokens):
+                segments.append({"paragraph": pid, "start": start, "end": end,
+                                 "tokens": count_tokens(text[start:end])})
+
+        k = 0
+        current = []
+        used = 0
+        for seg in segments:
+            if current and used + seg["tokens"] > max_tokens:
+                yield make_chunk(cid, chapter["number"], k, current, paragraphs)
+                k += 1
+                # Carry up to `overlap` tokens from the tail: whole segments, then the end of the next one
+                tail, tail_tokens = [], 0
+                for prev in reversed(current):
+                    room = min(overlap, max_tokens - seg["tokens"]) - tail_tokens
+                    if prev["tokens"] > room:
+                        part = tail_segment(prev, paragraphs[prev["paragraph"]], spans[prev["paragraph"]], room, count_tokens)
+                        if part:
+                            tail.insert(0, part)
+                            tail_tokens += part["tokens"]
+                        break
+                    tail.insert(0, prev)
+                    tail_tokens += prev["tokens"]
+                current, used = tail, tail_tokens
+            current.append(seg)
+            used += seg["tokens"]
+        if current:
+            yield make_chunk(cid, chapter["number"], k, current, paragraphs)
+
+
+def make_chunk(cid: str, number: int, k: int, segments: List[Dict], paragraphs: Dict[str, str]) -> Dict:
+    text, parts = chunk_text(segments, paragraphs)
+    return {
+        "id": f"{cid}_C{k}",
+        "chapter": number,
+        "text": text,
+        "tokens": sum(seg["tokens"] for seg in segments),
+        "spans": [{"paragraph": pid, "start": s, "end": e} for pid, s, e in parts],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chunk book paragraphs into token-bounded, entity-safe RAG chunks.")
+    parser.add_argument("book", help="Path to book JSON (with global_entities to protect entity spans)")
+    parser.add_argument("--output", "-o", required=True, help="Output JSONL path, one chunk per line")
+    parser.add_argument("--model", default="llama3.2", help="Model whose tokenizer sizes the chunks (see prompt_packer.py)")
+    parser.add_argument("--max-tokens", type=int, default=512, help="Maximum tokens per chunk")
+    parser.add_argument("--overlap", type=int, default=64, help="Tokens repeated from the previous chunk")
+    parser.add_argument("--normalize",
+                        help=f"Comma-separated alias normalizations, as given to entity_indexer.py (from: {', '.join(ALL_NORMALIZATIONS)}; "
+                             f"default: the registry's, or all)")
+    parser.add_argument("--registry", help="Compiled entity registry used by entity_indexer.py, (re)built from the book when stale")
+    args = parser.parse_args()
+
+    book = json.loads(Path(args.book).read_text(encoding="utf-8"))
+    # Protect the same spans entity_indexer.py tagged: same normalizations, same registry
+    normalizations = [n.strip() for n in args.normalize.split(",") if n.strip()] if args.normalize is not None else None
+    if args.registry:
+        from entity_registry import load_registry
+        matcher = load_registry(args.registry, args.book, normalizations,
+                                entities=book.get("global_entities", [])).matcher
+    else:
+        alias_map, _ = build_alias_lookup(book.get("global_entities", []))
+        matcher = AliasMatcher(alias_map, DEFAULT_NORMALIZATIONS if normalizations is None else normalizations) if alias_map else None
+    count = 0
+    with open(args.output, "w", encoding="utf-8") as f:
+        for chunk in iter_chunks(book, get_token_counter(args.model), args.max_tokens, args.overlap, matcher):
+            f.write(json.dumps(chunk) + "\n")
+            count += 1
+    print(f"[✓] {count} chunks written to {args.output}")
@@ -0,0 +1,143 @@
+import json
+import argparse
+import numpy as np
+from pathlib import Path
+from scipy import sparse
+from typing import Dict, List, Tuple
+from entity_registry import EntityRegistry, load_registry
+
+
+"""Precompute entity–entity co-occurrence from the entity mentions of a tagged book."""
+
+
+class CooccurrenceGraph:
+    """
+    Sparse entity co-occurrence at paragraph and chapter level.
+
+    paragraph_counts[i, j]: paragraphs mentioning both entities
+    paragraph_weights[i, j]: same, weighted by mention weight (1.0 for alias mentions, coreference mentions
+        below that: cluster agreement times resolve_mentions.COREF_DISCOUNT)
+    chapter_counts[i, j]: chapters mentioning both entities
+    first_chapter / last_chapter[i, j]: chapter numbers of the first and last shared chapter
+    """
+
+    def __init__(self, book: Dict, include_resolved: bool = True, registry: EntityRegistry = None):
+        if registry:
+            self.ids = list(registry.ids)
+            self.names = list(registry.names)
+        else:
+            entities = book.get("global_entities", [])
+            self.ids = [ent["id"] for ent in entities]
+            self.names = [ent["canonical_name"] for ent in entities]
+        self.index = {eid: i for i, eid in enumerate(self.ids)}
+
+        rows, cols, vals = [], [], []
+        chapter_rows, chapter_cols = [], []
+        chapter_numbers = []
+        offset = 0
+        for k, chapter in enumerate(book.get("chapters", [])):
+            chapter_numbers.append(chapter.get("number", k + 1))
+            weights = {}
+            for em in chapter.get("entity_mentions", []):
+                for eid in em.get("entities", []):
+                    weights[(em["paragraph_index"], eid)] = 1.0
+            if include_resolved:
+                for rm in chapter.get("resolved_mentions", []):
+                    for m in rm.get("mentions", []):
+                        key = (rm["paragraph_index"], m["entity"])
+                        weights[key] = max(weights.get(key, 0.0), m["weight"])
+            for (p, eid), w in weights.items():
+                if eid in self.index:
+                    rows.append(offset + p)
+                    cols.append(self.index[eid])
+                    vals.append(w)
+            for eid in {eid for _, eid in weights if eid in self.index}:
+                chapter_rows.append(k)
+                chapter_cols.append(self.index[eid])
+            offset += max(len(chapter.get("paragraphs", [])), max((p + 1 for p, _ in weights), default=0))
+
+        n = len(self.ids)
+        weighted = sparse.csr_matrix((vals, (rows, cols)), shape=(offset, n), dtype=np.float64)
+        present = weighted.copy()
+        present.data[:] = 1.0
+        chapters = sparse.csr_matrix((np.ones(len(chapter_rows)), (chapter_rows, chapter_cols)),
+                                     shape=(len(chapter_numbers), n), dtype=np.float64)
+
+        self.paragraph_counts = self._without_diagonal(present.T @ present)
+        self.paragraph_weights = self._without_diagonal(weighted.T @ weighted)
+        self.chapter_counts = self._without_diagonal(chapters.T @ chapters)
+
+        # First/last shared chapter: max over chapters of position * both-present, once forwards and once
+        # reversed, then mapped back to chapter numbers
+        numbers = np.asarray(chapter_numbers)
+        positions = np.arange(1, len(numbers) + 1, dtype=np.float64)
+        self.last_chapter = self._max_product(chapters, positions)
+        self.last_chapter.data = numbers[self.last_chapter.data.astype(int) - 1].astype(np.float64)
+        self.first_chapter = self._max_product(chapters, positions[::-1].copy())
+        self.first_chapter.data = numbers[len(numbers) - self.first_chapter.data.astype(int)].astype(np.float64)
+
+    @staticmethod
+    def _without_diagonal(matrix) -> sparse.csr_matrix:
+        matrix = sparse.csr_matrix(matrix)
+        matrix.setdiag(0)
+        matrix.eliminate_zeros()
+        return matrix
+
+    @classmethod
+    def _max_product(cls, chapters: sparse.csr_matrix, scores: np.ndarray) -> sparse.csr_matrix:
+        # Element-wise max over chapters of score_k * C[k, i] * C[k, j], built from per-chapter outer products
+        result = sparse.csr_matrix((chapters.shape[1], chapters.shape[1]))
+        for k in range(chapters.shape[0]):
+            row = chapters.getrow(k)
+            result = result.maximum(scores[k] * (row.T @ row))
+        return cls._without_diagonal(result)
+
+    def neighbors(self, entity_id: str, level: str = "paragraph", top_k: int = 10) -> List[Tuple[str, str, float]]:
+        """Return the top_k (id, canonical_name, score) neighbors of an entity at 'paragraph', 'weighted' or 'chapter' level."""
+        matrix = {"paragraph": self.paragraph_counts,
+                  "weighted": self.paragraph_weights,
+                  "chapter": self.chapter_counts}[level]
+        row = matrix.getrow(self.index[entity_id])
+        order = np.argsort(-row.data)[:top_k]
+        return [(self.ids[row.indices[i]], self.names[row.indices[i]], float(row.data[i])) for i in order]
+
+    def edges(self) -> List[Dict]:
+        """Return one record per co-occurring entity pair (i < j), keyed on chapter co-occurrence."""
+        upper = sparse.triu(self.chapter_counts, k=1).tocoo()
+        rows, cols = upper.row, upper.col
+        # Every other matrix is non-zero only where the pair shares a chapter: read them at the same positions
+        values = {name: np.asarray(matrix[rows, cols]).ravel() for name, matrix in (
+            ("paragraph_count", self.paragraph_counts), ("weight", self.paragraph_weights),
+            ("first_chapter", self.first_chapter), ("last_chapter", self.last_chapter))}
+        return [{
+            "source": self.ids[i],
+            "target": self.ids[j],
+            "paragraph_count": int(values["paragraph_count"][k]),
+            "weight": round(float(values["weight"][k]), 3),
+            "chapter_count": int(upper.data[k]),
+            "first_chapter": int(values["first_chapter"][k]),
+            "last_chapter": int(values["last_chapter"][k]),
+        } for k, (i, j) in enumerate(zip(rows.tolist(), cols.tolist()))]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query entity co-occurrence in a tagged book.")
+    parser.add_argument("book", help="Path to tagged book JSON (output of entity_indexer.py)")
+    parser.add_argument("entity", help="Entity id (or, with --registry, any alias) to list neighbors for")
+    parser.add_argument("--level", choices=["paragraph", "weighted", "chapter"], default="paragraph")
+    parser.add_argument("--top", type=int, default=10, help="Number of neighbors to show")
+    parser.add_argument("--explicit-only", action="store_true", help="Ignore coreference-resolved mentions")
+    parser.add_argument("--registry", help="Compiled entity registry (entity_registry.py) for entity names and aliases")
+    args = parser.parse_args()
+
+    book = json.loads(Path(args.book).read_text(encoding="utf-8"))
+    registry = load_registry(args.registry, args.book, normalizations=None,
+                             entities=book.get("global_entities", [])) if args.registry else None
+    graph = CooccurrenceGraph(book, include_resolved=not args.explicit_only, registry=registry)
+    entity = args.entity
+    if entity not in graph.index:
+        entity = registry.lookup(entity) if registry else None
+        if entity is None:
+            parser.error(f"No entity with id {'or alias ' if registry else ''}'{args.entity}'")
+    for eid, name, score in graph.neighbors(entity, level=args.level, top_k=args.top):
+        print(f"{eid}\t{name}\t{score:g}")
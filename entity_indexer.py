@@ -1,8 +1,8 @@
 import json
 import argparse
 from pathlib import Path
-from typing import List, Dict, Tuple
-import re
+from typing import List, Dict, Optional, Tuple
+from alias_matcher import AliasMatcher, ALL_NORMALIZATIONS, DEFAULT_NORMALIZATIONS
 
 
 def load_entity_registry(path: str) -> List[Dict]:
@@ -23,49 +23,49 @@ def build_alias_lookup(entities: List[Dict]) -> Tuple[Dict[str, str], Dict[str,
     return alias_map, id_to_name
 
 
-def tag_paragraph(paragraph: str, alias_map: Dict[str, str], markdown_style=False) -> Tuple[str, List[str]]:
+def tag_paragraph(paragraph: str, alias_map: Dict[str, str], markdown_style=False,
+                  matcher: Optional[AliasMatcher] = None) -> Tuple[str, List[str]]:
+    # Build the matcher once per book and pass it in; building it here is only a convenience.
+    matcher = matcher or AliasMatcher(alias_map)
     found_ids = set()
-    spans = sorted(alias_map.keys(), key=lambda x: -len(x))  # longest first
-    matches = []
+    pieces = []
+    last = 0
 
-    for span in spans:
-        pattern = re.compile(rf"({re.escape(span)})", re.IGNORECASE)
-        for match in pattern.finditer(paragraph):
-            start, end = match.span()
+    for start, end, eid in matcher.find(paragraph):
+        # Ensure we're not inside existing tag
+        if paragraph[max(0, start - 2):start].endswith("["):
+            continue
 
-            # Ensure we're not inside existing tag
-            if paragraph[max(0, start - 3):start] in ("[[", "["):
-                continue
+        found_ids.add(eid)
+        tag = f"[[{eid}]]" if markdown_style else f"[{eid}]"
+        pieces.append(paragraph[last:end])
+        pieces.append(f" {tag}")
+        last = end
 
-            # Ensure full word match (strict boundary check)
-            char_before = paragraph[start - 1] if start > 0 else ' '
-            char_after = paragraph[end] if end < len(paragraph) else ' '
-            if char_before.isalpha() or char_after.isalpha():
-                continue
+    pieces.append(paragraph[last:])
+    return "".join(pieces), sorted(found_ids)
 
-            if any(s <= start < e or s < end <= e for s, e in matches):
-                continue  # skip overlapping
 
-            eid = alias_map[span]
-            found_ids.add(eid)
-            tag = f"[[{eid}]]" if markdown_style else f"[{eid}]"
-            replacement = f"{match.group(1)} {tag}"
-            paragraph = paragraph[:start] + replacement + paragraph[end:]
-            matches.append((start, start + len(replacement)))
-
-    return paragraph, sorted(found_ids)
-
-
-def process_book_with_entities(book_path: str, entity_path: str, output_path: str, markdown_style=False):
+def process_book_with_entities(book_path: str, entity_path: str, output_path: str, markdown_style=False,
+                               normalizations=DEFAULT_NORMALIZATIONS, registry_path: Optional[str] = None):
     book = json.loads(Path(book_path).read_text(encoding='utf-8'))
-    entity_list = load_entity_registry(entity_path)
-    alias_map, id_to_name = build_alias_lookup(entity_list)
+    if registry_path:
+        # Compiled registry (entity_registry.py), rebuilt only when the entity file changed
+        from entity_registry import load_registry
+        registry = load_registry(registry_path, entity_path, normalizations)
+        entity_list = registry.entities()
+        alias_map = {}
+        matcher = registry.matcher
+    else:
+        entity_list = load_entity_registry(entity_path)
+        alias_map, id_to_name = build_alias_lookup(entity_list)
+        matcher = AliasMatcher(alias_map, normalizations)
 
     for chapter in book.get("chapters", []):
         tagged = []
         mention_map = []
         for i, p in enumerate(chapter.get("paragraphs", [])):
-            tagged_p, entity_ids = tag_paragraph(p, alias_map, markdown_style=markdown_style)
+            tagged_p, entity_ids = tag_paragraph(p, alias_map, markdown_style=markdown_style, matcher=matcher)
             tagged.append(tagged_p)
             mention_map.append({"paragraph_index": i, "entities": entity_ids})
         chapter["tagged_paragraphs"] = tagged
@@ -83,6 +83,9 @@ if __name__ == "__main__":
     parser.add_argument("entities", help="Path to global canonical entity list")
     parser.add_argument("--output", "-o", required=True, help="Output path for tagged book")
     parser.add_argument("--markdown-style", action="store_true", help="Use [[ID]] markdown-style tags (e.g., Obsidian style)")
+    parser.add_argument("--normalize", default=",".join(DEFAULT_NORMALIZATIONS),
+                        help=f"Comma-separated alias normalizations to apply (from: {', '.join(ALL_NORMALIZATIONS)}; empty for exact matching)")
+    parser.add_argument("--registry", help="Compiled entity registry to use, (re)built from the entities file when stale")
     args = parser.parse_args()
 
     # print(tag_paragraph("Mattie walked through Ganser Harbor with her father's watch.", {
@@ -91,5 +94,7 @@ if __name__ == "__main__":
     # "watch": "ITEM_001"
     # }))
     
-    process_book_with_entities(args.book, args.entities, args.output, markdown_style=args.markdown_style)
+    normalizations = [n.strip() for n in args.normalize.split(",") if n.strip()]
+    process_book_with_entities(args.book, args.entities, args.output, markdown_style=args.markdown_style,
+                               normalizations=normalizations, registry_path=args.registry)
     
\ No newline at end of file
@@ -0,0 +1,291 @@
+import os
+import json
+import mmap
+import struct
+import hashlib
+import argparse
+import numpy as np
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+from alias_matcher import END, EXACT, GAP, AliasMatcher, DEFAULT_NORMALIZATIONS, check_normalizations
+from entity_indexer import build_alias_lookup
+
+
+"""
+Compile the canonical entity list into a single registry file that loads via mmap in milliseconds:
+entity id/name/type arrays, the normalized alias table and the alias matcher trie as flat arrays,
+behind a header carrying the format version and the hash of the source entity list.
+
+Used by entity_indexer.py, cooccurrence.py and json_to_neo4jcsv.py through --registry.
+"""
+
+MAGIC = b"SRAGREG\0"
+REGISTRY_VERSION = 3
+ALIAS_SEPARATOR = "\x1f"
+
+
+def entities_sha256(entities: List[Dict]) -> str:
+    """Hash the entity list itself, so a registry compiled from book_entities.json is current for book_tagged.json."""
+    return hashlib.sha256(json.dumps(entities, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def load_entities(path: str) -> List[Dict]:
+    """Read entities from a canonicalized book JSON (global_entities) or a plain entity list."""
+    data = json.loads(Path(path).read_text(encoding="utf-8"))
+    return data.get("global_entities", []) if isinstance(data, dict) else data
+
+
+def encode_strings(values: Iterable[str]):
+    encoded = [v.encode("utf-8") for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+class StringTable:
+    """Read-only string array over a UTF-8 blob and its offsets; strings are decoded on access."""
+
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes().decode("utf-8")
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+def compile_registry(entities_path: str, registry_path: str, normalizations=DEFAULT_NORMALIZATIONS,
+                     entities: Optional[List[Dict]] = None):
+    entities = load_entities(entities_path) if entities is None else entities
+    alias_map, _ = build_alias_lookup(entities)
+    matcher = AliasMatcher(alias_map, normalizations)
+    index = {ent["id"]: i for i, ent in enumerate(entities)}
+
+    # Flatten the dict trie breadth-first: node n's edges are edge_tokens/edge_targets[edge_offsets[n]:edge_offsets[n+1]]
+    vocab = sorted({token for alias in alias_map for _, _, token in matcher.tokenize(alias)})
+    token_ids = {token: i for i, token in enumerate(vocab)}
+    nodes = [matcher.trie]
+    edge_offsets, edge_tokens, edge_targets, node_entity, node_gap = [0], [], [], [], []
+    exact_rows = []
+    for node in nodes:
+        children = sorted((token_ids[t], child) for t, child in node.items() if t not in (END, GAP, EXACT))
+        for tid, child in children:
+            edge_tokens.append(tid)
+            edge_targets.append(len(nodes))
+            nodes.append(child)
+        edge_offsets.append(len(edge_tokens))
+        eid = matcher.entity(node)
+        node_entity.append(index[eid] if eid is not None else -1)
+        node_gap.append(matcher.gap(node))
+        exact_rows.extend((len(node_entity) - 1, form, index[e]) for form, e in sorted(matcher.exact_entities(node).items()))
+
+    # Normalized keys shared by several entities are left out; lookup() falls back to the trie's exact forms
+    normalized = {}
+    for alias, eid in alias_map.items():
+        key = " ".join(t for _, _, t in matcher.tokenize(alias))
+        if key:
+            normalized.setdefault(key, set()).add(index[eid])
+    normalized_aliases = sorted((key, eids.pop()) for key, eids in normalized.items() if len(eids) == 1)
+
+    arrays = {}
+    arrays["vocab_blob"], arrays["vocab_offsets"] = encode_strings(vocab)
+    arrays["edge_offsets"] = np.asarray(edge_offsets, dtype=np.int64)
+    arrays["edge_tokens"] = np.asarray(edge_tokens, dtype=np.int32)
+    arrays["edge_targets"] = np.asarray(edge_targets, dtype=np.int32)
+    arrays["node_entity"] = np.asarray(node_entity, dtype=np.int32)
+    arrays["gap_blob"], arrays["gap_offsets"] = encode_strings(node_gap)
+    arrays["exact_node"] = np.asarray([n for n, _, _ in exact_rows], dtype=np.int32)
+    arrays["exact_blob"], arrays["exact_offsets"] = encode_strings(form for _, form, _ in exact_rows)
+    arrays["exact_entity"] = np.asarray([e for _, _, e in exact_rows], dtype=np.int32)
+    arrays["id_blob"], arrays["id_offsets"] = encode_strings(ent["id"] for ent in entities)
+    arrays["name_blob"], arrays["name_offsets"] = encode_strings(ent["canonical_name"] for ent in entities)
+    arrays["type_blob"], arrays["type_offsets"] = encode_strings(ent["type"] for ent in entities)
+    arrays["aliases_blob"], arrays["aliases_offsets"] = encode_strings(
+        ALIAS_SEPARATOR.join(ent.get("aliases", [])) for ent in entities)
+    arrays["alias_blob"], arrays["alias_offsets"] = encode_strings(a for a, _ in normalized_aliases)
+    arrays["alias_entity"] = np.asarray([e for _, e in normalized_aliases], dtype=np.int32)
+
+    stat = os.stat(entities_path)
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        offset = -(-offset // 8) * 8
+        layout[name] = [array.dtype.str, offset, int(array.size)]
+        offset += array.nbytes
+    header = json.dumps({
+        "version": REGISTRY_VERSION,
+        "source": {"path": str(Path(entities_path).resolve()), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                   "entities_sha256": entities_sha256(entities)},
+        "normalizations": sorted(matcher.normalizations),
+        "arrays": layout,
+    }).encode("utf-8")
+    header += b" " * (-(len(MAGIC) + 8 + len(header)) % 8)
+
+    # Write beside the target and swap it in: other processes may have the old file mmapped, and
+    # truncating it under them would crash them
+    tmp_path = f"{registry_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC + struct.pack("<II", REGISTRY_VERSION, len(header)) + header)
+        start = f.tell()
+        for name, array in arrays.items():
+            f.write(b"\0" * (start + layout[name][1] - f.tell()))
+            f.write(array.tobytes())
+    os.replace(tmp_path, registry_path)
+    print(f"[✓] Compiled registry of {len(entities)} entities, {len(nodes)} trie nodes to {registry_path}")
+
+
+def read_header(registry_path: str) -> Optional[Dict]:
+    with open(registry_path, "rb") as f:
+        prefix = f.read(len(MAGIC) + 8)
+        if len(prefix) < len(MAGIC) + 8 or prefix[:len(MAGIC)] != MAGIC:
+            return None
+        version, length = struct.unpack("<II", prefix[len(MAGIC):])
+        if version != REGISTRY_VERSION:
+            return None
+        return json.loads(f.read(length))
+
+
+class CompiledAliasMatcher(AliasMatcher):
+    """AliasMatcher walking the flat trie arrays of a compiled registry."""
+
+    def __init__(self, registry: "EntityRegistry", normalizations: Iterable[str]):
+        self.normalizations = check_normalizations(normalizations)
+        self.registry = registry
+        self.token_ids = {token: i for i, token in enumerate(registry.vocab)}
+
+    def root(self):
+        return 0
+
+    def child(self, node, token: str):
+        tid = self.token_ids.get(token)
+        if tid is None:
+            return None
+        lo, hi = self.registry.edge_offsets[node], self.registry.edge_offsets[node + 1]
+        i = lo + int(np.searchsorted(self.registry.edge_tokens[lo:hi], tid))
+        if i < hi and self.registry.edge_tokens[i] == tid:
+            return int(self.registry.edge_targets[i])
+        return None
+
+    def entity(self, node) -> Optional[str]:
+        e = self.registry.node_entity[node]
+        return self.registry.ids[e] if e >= 0 else None
+
+    def gap(self, node) -> str:
+        return self.registry.node_gap[node]
+
+    def exact_entities(self, node) -> Dict[str, str]:
+        lo, hi = np.searchsorted(self.registry.exact_node, [node, node + 1])
+        return {self.registry.exact_forms[k]: self.registry.ids[int(self.registry.exact_entity[k])] for k in range(lo, hi)}
+
+
+class EntityRegistry:
+    """A compiled registry mapped read-only into memory."""
+
+    def __init__(self, registry_path: str):
+        header = read_header(registry_path)
+        if header is None:
+            raise ValueError(f"{registry_path} is not a version {REGISTRY_VERSION} entity registry")
+        self.header = header
+        with open(registry_path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        data_start = len(MAGIC) + 8 + struct.unpack("<II", self._mmap[len(MAGIC):len(MAGIC) + 8])[1]
+        arrays = {name: np.frombuffer(self._mmap, dtype=np.dtype(dtype), count=count, offset=data_start + offset)
+                  for name, (dtype, offset, count) in header["arrays"].items()}
+
+        self.vocab = StringTable(arrays["vocab_blob"], arrays["vocab_offsets"])
+        self.edge_offsets = arrays["edge_offsets"]
+        self.edge_tokens = arrays["edge_tokens"]
+        self.edge_targets = arrays["edge_targets"]
+        self.node_entity = arrays["node_entity"]
+        self.node_gap = StringTable(arrays["gap_blob"], arrays["gap_offsets"])
+        self.exact_node = arrays["exact_node"]
+        self.exact_forms = StringTable(arrays["exact_blob"], arrays["exact_offsets"])
+        self.exact_entity = arrays["exact_entity"]
+        self.ids = StringTable(arrays["id_blob"], arrays["id_offsets"])
+        self.names = StringTable(arrays["name_blob"], arrays["name_offsets"])
+        self.types = StringTable(arrays["type_blob"], arrays["type_offsets"])
+        self.aliases = StringTable(arrays["aliases_blob"], arrays["aliases_offsets"])
+        self.alias_table = StringTable(arrays["alias_blob"], arrays["alias_offsets"])
+        self.alias_entity = arrays["alias_entity"]
+        self.matcher = CompiledAliasMatcher(self, header["normalizations"])
+
+    def entities(self) -> List[Dict]:
+        """Rebuild the canonical entity list (type, canonical_name, aliases, id)."""
+        return [{
+            "type": self.types[i],
+            "canonical_name": self.names[i],
+            "aliases": [a for a in self.aliases[i].split(ALIAS_SEPARATOR) if a],
+            "id": self.ids[i],
+        } for i in range(len(self.ids))]
+
+    def lookup(self, alias: str) -> Optional[str]:
+        """Return the entity id for an alias, normalized the same way as the matcher."""
+        key = " ".join(t for _, _, t in self.matcher.tokenize(alias))
+        lo, hi = 0, len(self.alias_table)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.alias_table[mid] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self.alias_table) and self.alias_table[lo] == key:
+            return self.ids[int(self.alias_entity[lo])]
+        # Shared by several entities: only an exact form resolves, through the trie
+        matches = self.matcher.find(alias.strip())
+        if len(matches) == 1 and matches[0][0] == 0 and matches[0][1] >= len(alias.strip().rstrip("'’")):
+            return matches[0][2]
+        return None
+
+
+def is_current(registry_path: str, entities_path: str, normalizations, entities: Optional[List[Dict]] = None) -> bool:
+    """
+    Check the registry header against an entity file: an unchanged stat of the file it was compiled from,
+    otherwise the hash of the entity list (any book JSON carrying the same global_entities). Pass the
+    already parsed entities to avoid reading entities_path again.
+    """
+    if not Path(registry_path).exists():
+        return False
+    header = read_header(registry_path)
+    if header is None or header["normalizations"] != sorted(normalizations):
+        return False
+    stat = os.stat(entities_path)
+    source = header["source"]
+    if (source.get("path") == str(Path(entities_path).resolve())
+            and stat.st_size == source["size"] and stat.st_mtime_ns == source["mtime_ns"]):
+        return True
+    entities = load_entities(entities_path) if entities is None else entities
+    return entities_sha256(entities) == source.get("entities_sha256")
+
+
+def load_registry(registry_path: str, entities_path: Optional[str] = None,
+                  normalizations: Optional[Iterable[str]] = DEFAULT_NORMALIZATIONS,
+                  entities: Optional[List[Dict]] = None) -> EntityRegistry:
+    """
+    Load a compiled registry, recompiling it first from entities_path when it is missing or stale.
+    With normalizations=None the registry keeps the normalizations it was compiled with; entities are the
+    already parsed contents of entities_path, if the caller has them.
+    """
+    if entities_path:
+        if normalizations is None:
+            header = read_header(registry_path) if Path(registry_path).exists() else None
+            normalizations = header["normalizations"] if header else DEFAULT_NORMALIZATIONS
+        if not is_current(registry_path, entities_path, normalizations, entities):
+            print(f"[+] Registry {registry_path} is missing or does not match {entities_path}, recompiling")
+            compile_registry(entities_path, registry_path, normalizations, entities)
+    return EntityRegistry(registry_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile the canonical entity list into an mmap-loadable registry.")
+    parser.add_argument("entities", help="Canonicalized book JSON (global_entities) or entity list JSON")
+    parser.add_argument("--output", "-o", required=True, help="Path of the compiled registry file")
+    parser.add_argument("--normalize", default=",".join(DEFAULT_NORMALIZATIONS),
+                        help="Comma-separated alias normalizations, as for entity_indexer.py")
+    args = parser.parse_args()
+
+    compile_registry(args.entities, args.output, [n.strip() for n in args.normalize.split(",") if n.strip()])
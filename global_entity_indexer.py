@@ -4,6 +4,8 @@ from pathlib import Path
 from collections import defaultdict
 from langchain.llms import Ollama
 from langchain.prompts import PromptTemplate
+from canonicalize_entities import EntityData
+from structured_output import llm_retry, parse_structured, report_stats
 
 # Maps spaCy labels to broader entity categories
 ENTITY_TYPE_MAP = {
@@ -61,12 +63,7 @@ def canonicalize_entities_ollama(global_entities, model="llama3"):
     full_prompt = prompt_template.format(entity_input=entity_input)
 
     result = llm.invoke(full_prompt)
-    try:
-        json_start = result.index("[")
-        json_end = result.rindex("]") + 1
-        return json.loads(result[json_start:json_end])
-    except Exception as e:
-        raise ValueError(f"Failed to parse JSON output:\n\n{result}") from e
+    return parse_structured(result, EntityData, stage="global_canonicalize", retry=llm_retry(llm), many=True)
 
 def assign_ids(canonical_entities):
     counts = defaultdict(int)
@@ -80,6 +77,7 @@ def main():
     parser = argparse.ArgumentParser(description="Canonicalize and index entities across chapters.")
     parser.add_argument("input", help="Path to full book JSON (with chapters and entities)")
     parser.add_argument("--output", "-o", help="Output path for enriched global entity list")
+    parser.add_argument("--stats", help="Append structured-output failure/repair counters to this JSONL file")
     args = parser.parse_args()
 
     data = json.loads(Path(args.input).read_text(encoding="utf-8"))
@@ -87,6 +85,7 @@ def main():
 
     global_entities = collect_global_entities(chapters)
     canonical = canonicalize_entities_ollama(global_entities)
+    report_stats(args.stats)
     enriched = assign_ids(canonical)
 
     if args.output:
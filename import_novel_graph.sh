@@ -14,20 +14,41 @@ if [[ "$confirm" != "y" ]]; then
   exit 1
 fi
 
+# Only pass the CSVs that were exported: entity types, summaries (summary_tree.py) and chunks
+# (chunk_paragraphs.py) depend on the book and the pipeline steps that were run
+IMPORT_ARGS=()
+add_csv() {
+  if [[ -f "$3" ]]; then
+    IMPORT_ARGS+=("--$1=$2=$3")
+  else
+    echo "[!] Skipping $3 (not exported)"
+  fi
+}
+
+add_csv nodes Character nodes_characters.csv
+add_csv nodes Place nodes_places.csv
+add_csv nodes Culture nodes_cultures.csv
+add_csv nodes Organization nodes_organizations.csv
+add_csv nodes Person nodes_persons.csv
+add_csv nodes Item nodes_items.csv
+add_csv nodes Chapter nodes_chapters.csv
+add_csv nodes Paragraph nodes_paragraphs.csv
+add_csv nodes Summary nodes_summaries.csv
+add_csv nodes Chunk nodes_chunks.csv
+add_csv nodes Date nodes_dates.csv
+add_csv nodes Group nodes_groups.csv
+add_csv relationships PART_OF rels_part_of.csv
+add_csv relationships MENTIONS rels_mentions.csv
+for f in rels_co_occurs_with_*.csv; do
+  add_csv relationships CO_OCCURS_WITH "$f"
+done
+add_csv relationships SUMMARIZES rels_summarizes_summaries.csv
+add_csv relationships SUMMARIZES rels_summarizes_paragraphs.csv
+add_csv relationships CONTAINS rels_contains.csv
+
 # Run neo4j-admin import
 $NEO4J_ADMIN database import full $DB_NAME \
-  --nodes=Character=nodes_characters.csv \
-  --nodes=Place=nodes_places.csv \
-  --nodes=Culture=nodes_cultures.csv \
-  --nodes=Organization=nodes_organizations.csv \
-  --nodes=Person=nodes_persons.csv \
-  --nodes=Item=nodes_items.csv \
-  --nodes=Chapter=nodes_chapters.csv \
-  --nodes=Paragraph=nodes_paragraphs.csv \
-  --nodes=Date=nodes_dates.csv \
-  --nodes=Group=nodes_groups.csv \
-  --relationships=PART_OF=rels_part_of.csv \
-  --relationships=MENTIONS=rels_mentions.csv \
+  "${IMPORT_ARGS[@]}" \
   --multiline-fields=true \
   --verbose \
   --quote='"'
@@ -1,8 +1,11 @@
+import re
 import json
 import csv
 import argparse
 from pathlib import Path
-from typing import List, Dict
+from typing import Iterable, Iterator, List, Dict
+from cooccurrence import CooccurrenceGraph
+from entity_registry import EntityRegistry, load_registry
 
 
 def sanitize(text: str) -> str:
@@ -16,16 +19,15 @@ def write_csv(path: Path, rows: List[Dict], headers: List[str]):
         writer.writerows(rows)
 
 
-def export_to_neo4j_csv(book_path: str, output_dir: str):
-    data = json.loads(Path(book_path).read_text(encoding="utf-8"))
-    Path(output_dir).mkdir(parents=True, exist_ok=True)
-
+def build_csv_rows(data: Dict, chunks: Iterable[Dict] = (), registry: EntityRegistry = None) -> Dict[str, List[Dict]]:
+    """Build the rows of every node and relationship CSV, keyed by file name."""
+    files = {}
     entity_types = {}
-    for ent in data["global_entities"]:
+    for ent in (registry.entities() if registry else data["global_entities"]):
         etype = ent["type"].lower()
         entity_types.setdefault(etype, []).append(ent)
 
-    # Write entity nodes
+    # Entity nodes
     for etype, entries in entity_types.items():
         rows = []
         for ent in entries:
@@ -34,9 +36,9 @@ def export_to_neo4j_csv(book_path: str, output_dir: str):
                 "canonical_name": ent["canonical_name"],
                 "aliases:string[]": "|".join(ent.get("aliases", []))
             })
-        write_csv(Path(output_dir) / f"nodes_{etype}s.csv", rows, list(rows[0].keys()))
+        files[f"nodes_{etype}s.csv"] = rows
 
-    # Write chapter nodes
+    # Chapter nodes
     chapter_rows = []
     paragraph_rows = []
     mentions = []
@@ -68,21 +70,297 @@ def export_to_neo4j_csv(book_path: str, output_dir: str):
                 mentions.append({
                     ":START_ID(Paragraph)": pid,
                     ":END_ID": eid,
-                    ":TYPE": "MENTIONS"
+                    ":TYPE": "MENTIONS",
+                    "weight:float": 1.0,
+                    "source": "alias"
+                })
+
+        # Pronoun/descriptive mentions from resolve_mentions.py
+        for rm in chapter.get("resolved_mentions", []):
+            pid = f"{cid}_P{rm['paragraph_index']}"
+            for m in rm.get("mentions", []):
+                mentions.append({
+                    ":START_ID(Paragraph)": pid,
+                    ":END_ID": m["entity"],
+                    ":TYPE": "MENTIONS",
+                    "weight:float": m["weight"],
+                    "source": "coref"
                 })
 
-    write_csv(Path(output_dir) / "nodes_chapters.csv", chapter_rows, list(chapter_rows[0].keys()))
-    write_csv(Path(output_dir) / "nodes_paragraphs.csv", paragraph_rows, list(paragraph_rows[0].keys()))
-    write_csv(Path(output_dir) / "rels_part_of.csv", part_of, list(part_of[0].keys()))
-    write_csv(Path(output_dir) / "rels_mentions.csv", mentions, list(mentions[0].keys()))
+    files["nodes_chapters.csv"] = chapter_rows
+    files["nodes_paragraphs.csv"] = paragraph_rows
+    files["rels_part_of.csv"] = part_of
+    files["rels_mentions.csv"] = mentions
+
+    # Entity nodes are in per-type ID groups, so co-occurrence is written per (type, type) pair
+    entity_group = {ent["id"]: etype.capitalize() for etype, entries in entity_types.items() for ent in entries}
+    for edge in CooccurrenceGraph(data, registry=registry).edges():
+        start, end = entity_group[edge["source"]], entity_group[edge["target"]]
+        files.setdefault(f"rels_co_occurs_with_{start.lower()}_{end.lower()}.csv", []).append({
+            f":START_ID({start})": edge["source"],
+            f":END_ID({end})": edge["target"],
+            ":TYPE": "CO_OCCURS_WITH",
+            "paragraph_count:int": edge["paragraph_count"],
+            "weight:float": edge["weight"],
+            "chapter_count:int": edge["chapter_count"],
+            "first_chapter:int": edge["first_chapter"],
+            "last_chapter:int": edge["last_chapter"]
+        })
+
+    # Summary tree from summary_tree.py
+    summary_rows = []
+    summarizes = {"Summary": [], "Paragraph": []}
+    tree = data.get("summary_tree", [])
+    summary_ids = {node["id"] for node in tree}
+    for node in tree:
+        summary_rows.append({
+            "id:ID(Summary)": node["id"],
+            "level": node["level"],
+            "summary": sanitize(node["summary"]),
+            "key": node["key"]
+        })
+        for child in node["children"]:
+            # Window summaries point at paragraphs, every higher level at summaries
+            group = "Summary" if child in summary_ids else "Paragraph"
+            summarizes[group].append({
+                ":START_ID(Summary)": node["id"],
+                f":END_ID({group})": child,
+                ":TYPE": "SUMMARIZES"
+            })
+    files["nodes_summaries.csv"] = summary_rows
+    files["rels_summarizes_summaries.csv"] = summarizes["Summary"]
+    files["rels_summarizes_paragraphs.csv"] = summarizes["Paragraph"]
+
+    # RAG chunks from chunk_paragraphs.py
+    chunk_rows = []
+    contains = []
+    for chunk in chunks:
+        chunk_rows.append({
+            "id:ID(Chunk)": chunk["id"],
+            "chapter:int": chunk["chapter"],
+            "tokens:int": chunk["tokens"],
+            "text": sanitize(chunk["text"])
+        })
+        for span in chunk["spans"]:
+            contains.append({
+                ":START_ID(Chunk)": chunk["id"],
+                ":END_ID(Paragraph)": span["paragraph"],
+                ":TYPE": "CONTAINS",
+                "char_start:int": span["start"],
+                "char_end:int": span["end"]
+            })
+    files["nodes_chunks.csv"] = chunk_rows
+    files["rels_contains.csv"] = contains
+
+    # Optional outputs (co-occurrence, summaries) are only written when present
+    return {name: rows for name, rows in files.items() if rows}
+
+
+# Snapshot of the last export, compared against by --delta
+SNAPSHOT_FILE = "export_snapshot.json"
+
+# Rows that come from optional inputs: when an input is not given, its rows are carried over from the
+# previous snapshot instead of being deleted
+OPTIONAL_INPUTS = {
+    "chunks": lambda name, row: name in ("nodes_chunks.csv", "rels_contains.csv"),
+    "summary_tree": lambda name, row: name == "nodes_summaries.csv" or name.startswith("rels_summarizes"),
+    "resolved_mentions": lambda name, row: name == "rels_mentions.csv" and row.get("source") == "coref",
+}
+
+
+def column_name(header: str) -> str:
+    """Map an import header to a plain column name: 'id:ID(Chapter)' -> 'id', ':START_ID' -> 'start', 'weight:float' -> 'weight'."""
+    if ":ID(" in header:
+        return "id"
+    if header.startswith(":START_ID"):
+        return "start"
+    if header.startswith(":END_ID"):
+        return "end"
+    if header == ":TYPE":
+        return "type"
+    return header.split(":")[0]
+
+
+def id_group(header: str):
+    match = re.search(r"\(([^)]+)\)", header)
+    return match.group(1) if match else None
+
+
+def row_key(row: Dict) -> str:
+    columns = {column_name(h): v for h, v in row.items()}
+    if "id" in columns:
+        return columns["id"]
+    return f"{columns['start']}|{columns['type']}|{columns['end']}"
+
+
+def build_snapshot(files: Dict[str, List[Dict]]) -> Dict:
+    labels = {}
+    for rows in files.values():
+        for row in rows:
+            for header, value in row.items():
+                if ":ID(" in header:
+                    labels[value] = id_group(header)
+    snapshot = {"labels": labels, "files": {name: {row_key(r): r for r in rows} for name, rows in files.items()}}
+    return json.loads(json.dumps(snapshot))  # normalize values so they compare equal to a loaded snapshot
+
+
+def carry_forward(previous: Dict, current: Dict, missing: List[str]):
+    """Copy the rows of optional inputs that were not given from the previous snapshot into the current one."""
+    for input_name in missing:
+        belongs = OPTIONAL_INPUTS[input_name]
+        carried = 0
+        for name, rows in sorted(previous["files"].items()):  # nodes_* before rels_*
+            for key, row in rows.items():
+                if not belongs(name, row) or key in current["files"].get(name, {}):
+                    continue
+                node_id = next((v for h, v in row.items() if ":ID(" in h), None)
+                if node_id is not None:
+                    current["labels"][node_id] = previous["labels"][node_id]
+                elif any(v not in current["labels"] for h, v in row.items() if h.startswith((":START_ID", ":END_ID"))):
+                    continue  # the node at the other end is gone
+                current["files"].setdefault(name, {})[key] = row
+                carried += 1
+        if carried:
+            print(f"[i] No {input_name} given, keeping {carried} rows from the previous export")
+
+
+def cypher_value(header: str) -> str:
+    column = column_name(header)
+    kind = header.split(":", 1)[1] if ":" in header.lstrip(":") else ""
+    if kind == "int":
+        return f"toInteger(row.{column})"
+    if kind == "float":
+        return f"toFloat(row.{column})"
+    if kind == "string[]":
+        return f"CASE row.{column} WHEN '' THEN [] ELSE split(row.{column}, '|') END"
+    return f"row.{column}"
+
+
+def write_delta_rows(path: Path, rows: List[Dict]):
+    plain = [{column_name(h): v for h, v in row.items()} for row in rows]
+    write_csv(path, plain, list(plain[0].keys()))
+
+
+def write_delta(previous: Dict, current: Dict, delta_dir: Path, import_prefix: str):
+    """
+    Write the added/changed and removed rows between two snapshots as delta CSVs, plus delta.cypher
+    with the LOAD CSV statements that apply them to a running database (e.g. cypher-shell -f delta.cypher).
+    """
+    delta_dir.mkdir(parents=True, exist_ok=True)
+    for old in list(delta_dir.glob("*.upsert.csv")) + list(delta_dir.glob("*.delete.csv")):
+        old.unlink()
+
+    statements = {"delete_rels": [], "delete_nodes": [], "upsert_nodes": [], "upsert_rels": []}
+    for name in sorted(set(previous["files"]) | set(current["files"])):
+        before = previous["files"].get(name, {})
+        after = current["files"].get(name, {})
+        upserts = [row for key, row in after.items() if before.get(key) != row]
+        removed = [row for key, row in before.items() if key not in after]
+        added = sum(key not in before for key in after)
+        print(f"[+] {name}: {added} added, {len(upserts) - added} changed, {len(removed)} removed")
+        stem = name[:-len(".csv")]
+
+        if name.startswith("nodes_"):
+            for rows, kind in ((upserts, "upsert"), (removed, "delete")):
+                if not rows:
+                    continue
+                id_header = next(h for h in rows[0] if ":ID(" in h)
+                label = id_group(id_header)
+                load = f"LOAD CSV WITH HEADERS FROM '{import_prefix}{stem}.{kind}.csv' AS row\n"
+                write_delta_rows(delta_dir / f"{stem}.{kind}.csv", rows)
+                if kind == "upsert":
+                    props = ", ".join(f"n.{column_name(h)} = {cypher_value(h)}" for h in rows[0] if h != id_header)
+                    statements["upsert_nodes"].append(load + f"MERGE (n:`{label}` {{id: row.id}})" + (f"\nSET {props}" if props else "") + ";")
+                else:
+                    statements["delete_nodes"].append(load + f"MATCH (n:`{label}` {{id: row.id}}) DETACH DELETE n;")
+            continue
+
+        for rows, kind, labels in ((upserts, "upsert", current["labels"]), (removed, "delete", previous["labels"])):
+            groups = {}
+            for row in rows:
+                start_header = next(h for h in row if h.startswith(":START_ID"))
+                end_header = next(h for h in row if h.startswith(":END_ID"))
+                start = id_group(start_header) or labels.get(row[start_header])
+                end = id_group(end_header) or labels.get(row[end_header])
+                if not start or not end:
+                    print(f"[!] Skipping {row_key(row)}: unknown node")
+                    continue
+                groups.setdefault((start, end), []).append(row)
+            for (start, end), group in groups.items():
+                group_stem = re.sub(r"\W+", "_", f"{stem}_{start}_{end}").lower()
+                rel_type = group[0][":TYPE"]
+                write_delta_rows(delta_dir / f"{group_stem}.{kind}.csv", group)
+                load = f"LOAD CSV WITH HEADERS FROM '{import_prefix}{group_stem}.{kind}.csv' AS row\n"
+                if kind == "upsert":
+                    props = ", ".join(f"r.{column_name(h)} = {cypher_value(h)}" for h in group[0] if not h.startswith(":"))
+                    statements["upsert_rels"].append(
+                        load + f"MATCH (a:`{start}` {{id: row.start}}), (b:`{end}` {{id: row.end}})\n"
+                        f"MERGE (a)-[r:{rel_type}]->(b)" + (f"\nSET {props}" if props else "") + ";")
+                else:
+                    statements["delete_rels"].append(
+                        load + f"MATCH (a:`{start}` {{id: row.start}})-[r:{rel_type}]->(b:`{end}` {{id: row.end}}) DELETE r;")
+
+    # Index the id lookups, then delete relationships before the nodes they point at are removed and
+    # create them after the nodes they need exist
+    labels = sorted(set(re.findall(r"\(\w:`([^`]+)` \{id:", "\n".join(sum(statements.values(), [])))))
+    indexes = [f"CREATE INDEX IF NOT EXISTS FOR (n:`{label}`) ON (n.id);" for label in labels]
+    ordered = indexes + statements["delete_rels"] + statements["delete_nodes"] + statements["upsert_nodes"] + statements["upsert_rels"]
+    (delta_dir / "delta.cypher").write_text("\n\n".join(ordered) + "\n", encoding="utf-8")
+    print(f"[✓] Delta of {len(ordered) - len(indexes)} LOAD CSV statements written to {delta_dir / 'delta.cypher'}")
+
+
+def read_jsonl(path: str) -> Iterator[Dict]:
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def export_to_neo4j_csv(book_path: str, output_dir: str, delta: bool = False, import_prefix: str = "file:///delta/",
+                        chunks_path: str = None, registry_path: str = None):
+    data = json.loads(Path(book_path).read_text(encoding="utf-8"))
+    out = Path(output_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    registry = load_registry(registry_path, book_path, normalizations=None,
+                             entities=data.get("global_entities", [])) if registry_path else None
+    files = build_csv_rows(data, read_jsonl(chunks_path) if chunks_path else (), registry)
+    current = build_snapshot(files)
+    snapshot_path = out / SNAPSHOT_FILE
 
-    print(f"[✓] Exported Neo4j CSVs to: {output_dir}")
+    if delta:
+        if not snapshot_path.exists():
+            raise FileNotFoundError(f"No previous export snapshot in {output_dir}; run a full export first")
+        previous = json.loads(snapshot_path.read_text(encoding="utf-8"))
+        given = {
+            "chunks": chunks_path is not None,
+            "summary_tree": "summary_tree" in data,
+            "resolved_mentions": any("resolved_mentions" in ch for ch in data["chapters"]),
+        }
+        carry_forward(previous, current, [name for name, present in given.items() if not present])
+        write_delta(previous, current, out / "delta", import_prefix)
+    else:
+        # CSVs of an earlier export that are empty now would otherwise be imported again
+        for old in list(out.glob("nodes_*.csv")) + list(out.glob("rels_*.csv")):
+            if old.name not in files:
+                old.unlink()
+                print(f"[+] Removed {old.name} (nothing to export)")
+        for name, rows in files.items():
+            write_csv(out / name, rows, list(rows[0].keys()))
+        print(f"[✓] Exported Neo4j CSVs to: {output_dir}")
 
+    snapshot_path.write_text(json.dumps(current), encoding="utf-8")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Export structured novel JSON to Neo4j-compatible CSVs.")
     parser.add_argument("input", help="Path to the full structured novel JSON file")
     parser.add_argument("--out", "-o", required=True, help="Directory to write CSVs")
+    parser.add_argument("--delta", action="store_true",
+                        help="Only write changes since the last export to <out>/delta, with a LOAD CSV script")
+    parser.add_argument("--import-prefix", default="file:///delta/",
+                        help="URL prefix the delta CSVs are loaded from (relative to Neo4j's import directory)")
+    parser.add_argument("--chunks", help="JSONL chunks from chunk_paragraphs.py to export as Chunk nodes")
+    parser.add_argument("--registry", help="Compiled entity registry (entity_registry.py) to export entities from")
     args = parser.parse_args()
 
-    export_to_neo4j_csv(args.input, args.out)
+    export_to_neo4j_csv(args.input, args.out, delta=args.delta, import_prefix=args.import_prefix,
+                        chunks_path=args.chunks, registry_path=args.registry)
@@ -6,6 +6,8 @@ from langchain.prompts import PromptTemplate
 from langchain.output_parsers import PydanticOutputParser
 from pydantic import BaseModel, Field
 from typing import List
+from prompt_packer import fit_text, get_budget, get_context_window, get_token_counter
+from structured_output import llm_retry, parse_structured, report_stats
 
 
 """This script uses the Ollama LLM to parse a chapter of a novel from a markdown file."""
@@ -32,11 +34,9 @@ class ChapterMetadata(BaseModel):
     summary: str
     
 
-def ask_llm_for_metadata(text: str, model_name: str = "llama3.2:latest") -> dict:
-    llm = ChatOllama(model=model_name, temperature=0, format='json') # OllamaLLM(model=model_name, temperature=0)
+def metadata_prompt() -> PromptTemplate:
     parser = PydanticOutputParser(pydantic_object=ChapterMetadata)
-    
-    prompt = PromptTemplate(
+    return PromptTemplate(
         template="""
     You are a helpful literary assistant.
 
@@ -52,14 +52,25 @@ def ask_llm_for_metadata(text: str, model_name: str = "llama3.2:latest") -> dict
         input_variables=["text"],
         partial_variables={"format_instructions": parser.get_format_instructions()}
     )
-    txtPrompt = prompt.invoke({"text": text[:8000]})  # Truncate if needed for model limits
-    structured_llm = llm.with_structured_output(ChapterMetadata, method="json_schema")
+
+def fit_chapter_text(text: str, prompt: PromptTemplate, model_name: str, context_tokens: int = None, reserve_tokens: int = None) -> str:
+    """Truncate chapter text so the prompt around it fits the model's prompt budget."""
+    budget = get_budget(model_name, context_tokens, reserve_tokens)
+    count_tokens = get_token_counter(model_name)
+    overhead = count_tokens(prompt.format(text=""))
+    return fit_text(text, budget - overhead, count_tokens)
+
+def ask_llm_for_metadata(text: str, model_name: str = "llama3.2:latest", context_tokens: int = None, reserve_tokens: int = None) -> dict:
+    llm = ChatOllama(model=model_name, temperature=0, format='json', num_ctx=get_context_window(model_name, context_tokens)) # OllamaLLM(model=model_name, temperature=0)
+    prompt = metadata_prompt()
+    txtPrompt = prompt.invoke({"text": fit_chapter_text(text, prompt, model_name, context_tokens, reserve_tokens)})  # Truncate to the model's prompt budget
+    structured_llm = llm.with_structured_output(ChapterMetadata, method="json_schema", include_raw=True)
     # chain = prompt | llm.with_structured_output(ChapterMetadata, method="json_schema") | parser
     response = structured_llm.invoke(txtPrompt) #chain.invoke({"text": text[:8000]})  # Truncate if needed for model limits
-    dictResponse = response.model_dump(mode="json")
+    dictResponse = parse_structured(response["raw"].content, ChapterMetadata, stage="chapter_metadata", retry=llm_retry(llm))
     return dictResponse
 
-def parse_chapter_with_ollama(file_path: str, model_name: str = "llama3.2:latest") -> dict:
+def parse_chapter_with_ollama(file_path: str, model_name: str = "llama3.2:latest", context_tokens: int = None, reserve_tokens: int = None) -> dict:
     """
     Parse a chapter from a markdown file and extract metadata using the Ollama LLM.
     Expects frontmatter in yaml like:
@@ -78,7 +89,7 @@ def parse_chapter_with_ollama(file_path: str, model_name: str = "llama3.2:latest
     full_text = post.content.strip()
     metadata = post.metadata
 
-    llm_metadata = ask_llm_for_metadata(full_text, model_name)
+    llm_metadata = ask_llm_for_metadata(full_text, model_name, context_tokens, reserve_tokens)
 
     return {
         "id": f"chapter_{metadata.get('number', 0)}",
@@ -103,9 +114,14 @@ if __name__ == "__main__":
     parser.add_argument("file", type=str, help="Path to the markdown file")
     parser.add_argument("--output", type=str, help="Optional output file to write JSON to")
     parser.add_argument("--model", type=str, default="llama3.2:latest", help="Ollama model name to use")
+    parser.add_argument("--context-tokens", type=int, help="Override the model's context window (see prompt_packer.py)")
+    parser.add_argument("--reserve-tokens", type=int, help="Override the tokens reserved for the model's reply")
+    parser.add_argument("--stats", type=str, help="Append structured-output failure/repair counters to this JSONL file")
 
     args = parser.parse_args()
-    result = parse_chapter_with_ollama(args.file, model_name=args.model)
+    result = parse_chapter_with_ollama(args.file, model_name=args.model,
+                                       context_tokens=args.context_tokens, reserve_tokens=args.reserve_tokens)
+    report_stats(args.stats)
 
     if args.output:
         with open(args.output, "w") as f:
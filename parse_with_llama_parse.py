@@ -1,9 +1,12 @@
 import argparse
 import os
+import time
+import hashlib
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import json
 import dotenv
-from llama_parse import LlamaParse
+from llama_index.core import Document
 from llama_index.core.node_parser import MarkdownElementNodeParser
 from langchain_ollama import ChatOllama, OllamaLLM
 
@@ -12,21 +15,52 @@ dotenv.load_dotenv()
 # This should be set in your environment or .env file
 LLAMA_PARSE_KEY=os.environ.get("LLAMA_PARSE_KEY", None)
 
-def parse_with_llama(file_path, model_name="llama3.2", output=None):
+SUPPORTED_SUFFIXES = {".pdf", ".md", ".markdown"}
+
+
+def load_with_llama_parse(file_path):
+    """Parse a document to markdown with the LlamaParse cloud API."""
+    from llama_parse import LlamaParse
+    return LlamaParse(api_key=LLAMA_PARSE_KEY, result_type="markdown").load_data(file_path)
+
+
+def load_with_local_parser(file_path):
+    """Parse a document to markdown offline: markdown is read as is, PDFs go through pymupdf4llm."""
+    path = Path(file_path)
+    if path.suffix.lower() == ".pdf":
+        import pymupdf4llm
+        pages = pymupdf4llm.to_markdown(str(path), page_chunks=True)
+        return [Document(text=page["text"], metadata={"file_path": str(path), "page": i + 1})
+                for i, page in enumerate(pages)]
+    return [Document(text=path.read_text(encoding="utf-8"), metadata={"file_path": str(path)})]
+
+
+# Document loaders by backend name; each takes a file path and returns llama_index Documents
+PARSER_BACKENDS = {
+    "llama-parse": load_with_llama_parse,
+    "local": load_with_local_parser,
+}
+
+
+def parse_to_nodes(file_path, llm, backend="llama-parse", num_workers=8):
+    documents = PARSER_BACKENDS[backend](file_path)
+    node_parser = MarkdownElementNodeParser(llm=llm, num_workers=num_workers)
+    nodes = node_parser.get_nodes_from_documents(documents)
+    base_nodes, objects = node_parser.get_nodes_and_objects(nodes)
+    return documents, base_nodes, objects
+
+
+def parse_with_llama(file_path, model_name="llama3.2", output=None, backend="llama-parse"):
     if not Path(file_path).exists():
         raise FileNotFoundError(f"File not found: {file_path}")
 
     # Instantiate LLM for Markdown parsing
     llm = OllamaLLM(model=model_name)
 
-    # Load document and parse with llama-parse
-    print(f"[+] Loading file with LlamaParse: {file_path}")
-    documents = LlamaParse(api_key=LLAMA_PARSE_KEY, result_type="markdown").load_data(file_path)
-
+    # Load document with the chosen backend and parse into nodes
+    print(f"[+] Loading file with {backend}: {file_path}")
     print("[+] Parsing markdown into semantic nodes and objects...")
-    node_parser = MarkdownElementNodeParser(llm=llm, num_workers=8)
-    nodes = node_parser.get_nodes_from_documents(documents)
-    base_nodes, objects = node_parser.get_nodes_and_objects(nodes)
+    _, base_nodes, objects = parse_to_nodes(file_path, llm, backend=backend)
 
     results = {
         "nodes": [n.to_dict() for n in base_nodes],
@@ -41,11 +75,126 @@ def parse_with_llama(file_path, model_name="llama3.2", output=None):
         print(json.dumps(results, indent=2))
 
 
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_checkpoint(path):
+    """Return {file: sha256} for files already ingested."""
+    done = {}
+    if path.exists():
+        for line in path.read_text(encoding="utf-8").splitlines():
+            if line.strip():
+                entry = json.loads(line)
+                done[entry["file"]] = entry["sha256"]
+    return done
+
+
+def drop_records(path, sources):
+    """Rewrite a JSONL output without the records of the given source files, so re-parsed files replace them."""
+    if not path.exists() or not sources:
+        return
+    tmp = path.with_name(path.name + ".tmp")
+    dropped = 0
+    with path.open(encoding="utf-8") as src, tmp.open("w", encoding="utf-8") as dst:
+        for line in src:
+            if line.strip() and json.loads(line).get("source") in sources:
+                dropped += 1
+                continue
+            dst.write(line)
+    tmp.replace(path)
+    if dropped:
+        print(f"[+] Removed {dropped} stale records of re-parsed files from {path}")
+
+
+def ingest_one(file_path, llm, backend, num_workers):
+    start = time.perf_counter()
+    documents, base_nodes, objects = parse_to_nodes(file_path, llm, backend=backend, num_workers=num_workers)
+    seconds = time.perf_counter() - start
+    chars = sum(len(d.text) for d in documents)
+    stats = {
+        "documents": len(documents),
+        "nodes": len(base_nodes),
+        "objects": len(objects),
+        "chars": chars,
+        "seconds": round(seconds, 2),
+        "chars_per_second": round(chars / seconds, 1) if seconds else None,
+    }
+    records = [{"source": str(file_path), "kind": "node", **n.to_dict()} for n in base_nodes]
+    records += [{"source": str(file_path), "kind": "object", **o.to_dict()} for o in objects]
+    return records, stats
+
+
+def ingest_batch(inputs, output, model_name="llama3.2", backend="llama-parse", workers=4, node_workers=8):
+    """
+    Parse many files with a bounded worker pool, streaming nodes to a JSONL file.
+
+    Finished files are recorded in <output>.checkpoint.jsonl with their hash and throughput, and skipped on
+    the next run unless they changed. Records left in the output by files that are parsed again are removed first.
+    """
+    files = []
+    for item in inputs:
+        # Absolute paths, so the checkpoint and the records' source match whatever cwd the next run uses
+        path = Path(item).resolve()
+        if path.is_dir():
+            files.extend(sorted(p for p in path.rglob("*") if p.suffix.lower() in SUPPORTED_SUFFIXES))
+        elif path.exists():
+            files.append(path)
+        else:
+            raise FileNotFoundError(f"File not found: {item}")
+
+    output = Path(output)
+    checkpoint = output.with_name(output.name + ".checkpoint.jsonl")
+    done = load_checkpoint(checkpoint)
+    digests = {str(p): file_digest(p) for p in files}
+    todo = [p for p in files if done.get(str(p)) != digests[str(p)]]
+    print(f"[+] {len(todo)} of {len(files)} files to parse with {backend} ({len(files) - len(todo)} already done)")
+    drop_records(output, {str(p) for p in todo})
+
+    llm = OllamaLLM(model=model_name)
+    with output.open("a", encoding="utf-8") as out, checkpoint.open("a", encoding="utf-8") as ckpt, \
+            ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(ingest_one, p, llm, backend, node_workers): p for p in todo}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                records, stats = future.result()
+            except Exception as e:
+                print(f"[✗] Failed to parse {path}: {e}")
+                continue
+            for record in records:
+                out.write(json.dumps(record) + "\n")
+            out.flush()
+            ckpt.write(json.dumps({"file": str(path), "sha256": digests[str(path)], **stats}) + "\n")
+            ckpt.flush()
+            print(f"[✓] {path}: {stats['nodes']} nodes, {stats['objects']} objects in {stats['seconds']}s "
+                  f"({stats['chars_per_second']} chars/s)")
+
+    print(f"[✓] Nodes written to {output}, progress in {checkpoint}")
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Parse documents using LlamaParse + MarkdownElementNodeParser + Ollama")
-    parser.add_argument("file", type=str, help="Path to PDF or markdown file")
+    parser.add_argument("file", type=str, nargs="+", help="Path to PDF or markdown file (several files or directories with --batch)")
     parser.add_argument("--model", type=str, default="llama3.2", help="Ollama model name")
-    parser.add_argument("--out", type=str, help="Output JSON file")
+    parser.add_argument("--out", type=str, help="Output JSON file (JSONL with --batch)")
+    parser.add_argument("--backend", choices=sorted(PARSER_BACKENDS), default="llama-parse",
+                        help="Document parser: LlamaParse cloud API or the offline local parser")
+    parser.add_argument("--batch", action="store_true", help="Parse many files in parallel, resumable, streaming JSONL")
+    parser.add_argument("--workers", type=int, default=4, help="Files parsed concurrently in --batch mode")
+    parser.add_argument("--node-workers", type=int, default=8, help="Workers for MarkdownElementNodeParser")
 
     args = parser.parse_args()
-    parse_with_llama(args.file, model_name=args.model, output=args.out)
\ No newline at end of file
+    if args.batch:
+        if not args.out:
+            parser.error("--out is required with --batch")
+        ingest_batch(args.file, args.out, model_name=args.model, backend=args.backend,
+                     workers=args.workers, node_workers=args.node_workers)
+    else:
+        if len(args.file) > 1:
+            parser.error("Pass --batch to parse more than one file")
+        parse_with_llama(args.file[0], model_name=args.model, output=args.out, backend=args.backend)
@@ -0,0 +1,182 @@
+import json
+import argparse
+from pathlib import Path
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, List, Optional
+
+
+"""Token-budget-aware prompt packing shared by the LLM stages."""
+
+# Context window (num_ctx) and tokens reserved for the model's reply, per Ollama model.
+# Override at the command line with --context-tokens / --reserve-tokens.
+MODEL_CONTEXT_BUDGETS = {
+    "llama3.2": {"context": 4096, "reserve": 1024},
+    "llama3.2:latest": {"context": 4096, "reserve": 1024},
+    "llama3": {"context": 8192, "reserve": 2048},
+    "deepseek-r1": {"context": 4096, "reserve": 1536},
+}
+DEFAULT_BUDGET = {"context": 4096, "reserve": 1024}
+
+# Hugging Face tokenizers matching the Ollama models. The official meta-llama repos are gated and need a
+# Hugging Face login, so the Llama entries point at ungated mirrors with the same tokenizer.json.
+# Without network access (or for unlisted models) token counts fall back to CHARS_PER_TOKEN.
+MODEL_TOKENIZERS = {
+    "llama3.2": "unsloth/Llama-3.2-1B",
+    "llama3.2:latest": "unsloth/Llama-3.2-1B",
+    "llama3": "unsloth/llama-3-8b",
+    "deepseek-r1": "deepseek-ai/DeepSeek-R1-Distill-Qwen-7B",
+}
+
+# Rough English-prose ratio used when no tokenizer can be loaded.
+CHARS_PER_TOKEN = 4
+
+
+def get_context_window(model: str, context_tokens: Optional[int] = None) -> int:
+    """Return the context window (num_ctx) to request from Ollama for a model."""
+    return context_tokens or MODEL_CONTEXT_BUDGETS.get(model, DEFAULT_BUDGET)["context"]
+
+
+def get_reserve(model: str, context_tokens: Optional[int] = None, reserve_tokens: Optional[int] = None) -> int:
+    """Return the number of tokens reserved for the model's reply."""
+    context = get_context_window(model, context_tokens)
+    reserve = reserve_tokens if reserve_tokens is not None else MODEL_CONTEXT_BUDGETS.get(model, DEFAULT_BUDGET)["reserve"]
+    if reserve >= context:
+        raise ValueError(f"Reserved output tokens ({reserve}) must be smaller than the context ({context})")
+    return reserve
+
+
+def get_budget(model: str, context_tokens: Optional[int] = None, reserve_tokens: Optional[int] = None) -> int:
+    """Return the number of prompt tokens available for a model after reserving room for output."""
+    return get_context_window(model, context_tokens) - get_reserve(model, context_tokens, reserve_tokens)
+
+
+@lru_cache(maxsize=None)
+def get_token_counter(model: str) -> Callable[[str], int]:
+    """Return a token counting function for the model, falling back to a character estimate (warns once per model)."""
+    repo_id = MODEL_TOKENIZERS.get(model)
+    if repo_id:
+        try:
+            from tokenizers import Tokenizer
+            tokenizer = Tokenizer.from_pretrained(repo_id)
+            return lambda text: len(tokenizer.encode(text, add_special_tokens=False).ids)
+        except Exception as e:
+            print(f"[!] Could not load tokenizer for '{model}' ({e}), estimating tokens from length.")
+    return lambda text: -(-len(text) // CHARS_PER_TOKEN)
+
+
+def pack_items(items: Iterable[str], overhead: int, budget: int, count_tokens: Callable[[str], int],
+               separator: str = ", ", output_tokens: Optional[Callable[[str], int]] = None,
+               output_budget: Optional[int] = None) -> List[List[str]]:
+    """
+    Greedily pack items into batches whose joined size plus the fixed prompt overhead fits the budget.
+
+    Args:
+        items: Strings to pack, in order.
+        overhead: Tokens taken by the prompt template around the packed items.
+        budget: Prompt tokens available (see get_budget).
+        count_tokens: Token counting function (see get_token_counter).
+        separator: String placed between items in the prompt.
+        output_tokens: Estimated reply tokens per item, for prompts whose reply grows with the batch.
+        output_budget: Reply tokens available (see get_reserve); batches are also cut to fit it.
+
+    Returns:
+        list: Batches of items. An item that does not fit on its own gets a batch to itself.
+    """
+    available = budget - overhead
+    sep_tokens = count_tokens(separator)
+    batches = []
+    current = []
+    used = 0
+    reply = 0
+    for item in items:
+        cost = count_tokens(item) + (sep_tokens if current else 0)
+        reply_cost = output_tokens(item) if output_tokens and output_budget is not None else 0
+        if current and (used + cost > available or (reply_cost and reply + reply_cost > output_budget)):
+            batches.append(current)
+            current = []
+            used = 0
+            reply = 0
+            cost = count_tokens(item)
+        current.append(item)
+        used += cost
+        reply += reply_cost
+    if current:
+        batches.append(current)
+    return batches
+
+
+def fit_text(text: str, budget: int, count_tokens: Callable[[str], int]) -> str:
+    """Return the longest prefix of text that fits within budget tokens, cut on a whitespace boundary."""
+    if count_tokens(text) <= budget:
+        return text
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if count_tokens(text[:mid]) <= budget:
+            lo = mid
+        else:
+            hi = mid - 1
+    cut = text.rfind(" ", 0, lo)
+    return text[:cut if cut > 0 else lo]
+
+
+def report_savings(book_path: str, model: str, batch_size: int = 10,
+                   context_tokens: Optional[int] = None, reserve_tokens: Optional[int] = None) -> Dict:
+    """Compare fixed-size canonicalization batches and 8000-char chapter truncation against token packing."""
+    from canonicalize_entities import collect_global_entities, deduplicate_aliases, pack_entity_values
+    from parse_chapter_llm import fit_chapter_text, metadata_prompt
+
+    data = json.loads(Path(book_path).read_text(encoding="utf-8"))
+    chapters = data.get("chapters", [data])
+    budget = get_budget(model, context_tokens, reserve_tokens)
+    reserve = get_reserve(model, context_tokens, reserve_tokens)
+    count_tokens = get_token_counter(model)
+
+    grouped_by_type = {}
+    for ent in deduplicate_aliases(collect_global_entities(chapters)):
+        grouped_by_type.setdefault(ent["type"], []).append(ent["value"])
+
+    fixed_calls = 0
+    packed_calls = 0
+    for etype, values in grouped_by_type.items():
+        fixed_calls += -(-len(values) // batch_size)
+        packed_calls += len(pack_entity_values(etype, values, budget, reserve, count_tokens))
+
+    prompt = metadata_prompt()
+    chapter_chars = 0
+    fixed_chars = 0
+    packed_chars = 0
+    for ch in chapters:
+        text = "\n".join(ch.get("paragraphs", [])) or ch.get("full_text", "")
+        chapter_chars += len(text)
+        fixed_chars += len(text[:8000])
+        packed_chars += len(fit_chapter_text(text, prompt, model, context_tokens, reserve_tokens))
+
+    return {
+        "model": model,
+        "prompt_budget_tokens": budget,
+        "canonicalize_calls_fixed": fixed_calls,
+        "canonicalize_calls_packed": packed_calls,
+        "canonicalize_calls_saved": fixed_calls - packed_calls,
+        "chapter_chars_total": chapter_chars,
+        "chapter_chars_sent_fixed": fixed_chars,
+        "chapter_chars_sent_packed": packed_chars,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report LLM calls saved by token-budget packing on a book JSON.")
+    parser.add_argument("book_json", help="Path to JSON file containing chapters with spaCy entities.")
+    parser.add_argument("--model", default="llama3.2", help="Ollama model whose context budget to use.")
+    parser.add_argument("--batch-size", type=int, default=10, help="Fixed batch size to compare against.")
+    parser.add_argument("--context-tokens", type=int, help="Override the model's context window.")
+    parser.add_argument("--reserve-tokens", type=int, help="Override the tokens reserved for output.")
+    args = parser.parse_args()
+
+    report = report_savings(args.book_json, args.model, batch_size=args.batch_size,
+                            context_tokens=args.context_tokens, reserve_tokens=args.reserve_tokens)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
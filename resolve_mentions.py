@@ -0,0 +1,139 @@
+import json
+import hashlib
+import argparse
+import spacy
+from pathlib import Path
+from collections import Counter
+from typing import Dict, List
+from alias_matcher import AliasMatcher
+from entity_indexer import build_alias_lookup
+
+
+"""
+Resolve pronoun and descriptive mentions ("she", "the old man") to canonical entities with a local
+coreference model, run after entity_indexer.py. Each paragraph is resolved together with the paragraphs
+before it, and results are cached by the hash of that window so reruns only touch edited paragraphs.
+
+Needs spacy-experimental and its coreference model:
+    pip install spacy-experimental
+    pip install https://github.com/explosion/spacy-experimental/releases/download/v0.6.1/en_coreference_web_trf-3.4.0a2-py3-none-any.whl
+"""
+
+PARAGRAPH_SEPARATOR = "\n\n"
+# Coreference mentions are weighted by the agreement of their cluster times this discount, so they always
+# weigh less than explicit alias mentions (1.0)
+COREF_DISCOUNT = 0.8
+
+
+def window_key(window: List[str], target: str, explicit: set, salt: str) -> str:
+    digest = hashlib.sha256(salt.encode("utf-8"))
+    for text in window:
+        digest.update(b"\0" + text.encode("utf-8"))
+    digest.update(b"\1" + target.encode("utf-8"))
+    # Results skip explicitly tagged entities, so re-tagging the book must not reuse them
+    digest.update(b"\2" + "\0".join(sorted(explicit)).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def load_cache(path: Path) -> Dict[str, List[Dict]]:
+    if path and path.exists():
+        return json.loads(path.read_text(encoding="utf-8"))
+    return {}
+
+
+def save_cache(path: Path, cache: Dict[str, List[Dict]]):
+    if path:
+        path.write_text(json.dumps(cache), encoding="utf-8")
+
+
+def coref_clusters(doc) -> List[list]:
+    return [list(group) for key, group in doc.spans.items() if key.startswith("coref_clusters")]
+
+
+def resolve_window(doc, target_start: int, matcher: AliasMatcher, explicit: set) -> List[Dict]:
+    """
+    Resolve the clusters of one window into weighted mentions for the target (last) paragraph.
+
+    A cluster is assigned to an entity when its named spans end on an alias of that entity; its agreement is
+    the share of named spans agreeing on it. Entities already tagged explicitly in the paragraph are skipped.
+    """
+    agreements = {}
+    for cluster in coref_clusters(doc):
+        votes = Counter()
+        for span in cluster:
+            text = span.text.strip()
+            for start, end, eid in matcher.find(text):
+                if end == len(text):
+                    votes[eid] += 1
+        if not votes:
+            continue
+        eid, count = votes.most_common(1)[0]
+        if eid in explicit or not any(span.start_char >= target_start for span in cluster):
+            continue
+        agreements[eid] = max(agreements.get(eid, 0.0), count / sum(votes.values()))
+    return [{"entity": eid, "agreement": a} for eid, a in sorted(agreements.items())]
+
+
+def resolve_chapter(chapter: Dict, nlp, matcher: AliasMatcher, cache: Dict[str, List[Dict]],
+                    cache_salt: str, context: int = 3, batch_size: int = 16,
+                    discount: float = COREF_DISCOUNT) -> List[Dict]:
+    paragraphs = chapter.get("paragraphs", [])
+    explicit = {em["paragraph_index"]: set(em.get("entities", [])) for em in chapter.get("entity_mentions", [])}
+
+    keys = []
+    pending = []
+    for i, para in enumerate(paragraphs):
+        window = paragraphs[max(0, i - context):i]
+        key = window_key(window, para, explicit.get(i, set()), cache_salt)
+        keys.append(key)
+        if key not in cache:
+            pending.append((i, key, PARAGRAPH_SEPARATOR.join(window + [para])))
+
+    texts = (text for _, _, text in pending)
+    for (i, key, text), doc in zip(pending, nlp.pipe(texts, batch_size=batch_size)):
+        target_start = len(text) - len(paragraphs[i])
+        cache[key] = resolve_window(doc, target_start, matcher, explicit.get(i, set()))
+
+    print(f"[+] Chapter {chapter.get('number')}: {len(pending)} of {len(paragraphs)} paragraphs resolved, rest cached")
+    return [{"paragraph_index": i,
+             "mentions": [{"entity": m["entity"], "weight": round(m["agreement"] * discount, 3)} for m in cache[key]]}
+            for i, key in enumerate(keys) if cache[key]]
+
+
+def process_book_mentions(book_path: str, output_path: str, model: str = "en_coreference_web_trf",
+                          cache_path: str = None, context: int = 3, batch_size: int = 16,
+                          discount: float = COREF_DISCOUNT):
+    if not 0 < discount < 1:
+        raise ValueError(f"Coreference discount must be between 0 and 1 (exclusive), got {discount}")
+    book = json.loads(Path(book_path).read_text(encoding="utf-8"))
+    alias_map, _ = build_alias_lookup(book.get("global_entities", []))
+    matcher = AliasMatcher(alias_map)
+    # Cached results depend on the model and the entity registry as well as the text
+    cache_salt = model + ":agreement:" + hashlib.sha256(json.dumps(alias_map, sort_keys=True).encode("utf-8")).hexdigest()
+    cache_file = Path(cache_path) if cache_path else None
+    cache = load_cache(cache_file)
+    nlp = spacy.load(model)
+
+    for chapter in book.get("chapters", []):
+        chapter["resolved_mentions"] = resolve_chapter(chapter, nlp, matcher, cache, cache_salt,
+                                                       context=context, batch_size=batch_size, discount=discount)
+        save_cache(cache_file, cache)  # checkpoint after each chapter
+
+    Path(output_path).write_text(json.dumps(book, indent=2), encoding="utf-8")
+    print(f"[✓] Book with resolved mentions written to {output_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Resolve pronoun and descriptive mentions to canonical entities.")
+    parser.add_argument("book", help="Path to tagged book JSON (output of entity_indexer.py)")
+    parser.add_argument("--output", "-o", required=True, help="Output path for book with resolved mentions")
+    parser.add_argument("--model", "-m", default="en_coreference_web_trf", help="spaCy coreference model")
+    parser.add_argument("--cache", help="Path to JSON cache of resolved paragraphs (reused across runs)")
+    parser.add_argument("--context", type=int, default=3, help="Preceding paragraphs to include with each paragraph")
+    parser.add_argument("--batch-size", type=int, default=16, help="Windows per spaCy batch")
+    parser.add_argument("--discount", type=float, default=COREF_DISCOUNT,
+                        help="Weight of a fully agreeing coreference mention, below the 1.0 of alias mentions")
+    args = parser.parse_args()
+
+    process_book_mentions(args.book, args.output, model=args.model, cache_path=args.cache,
+                          context=args.context, batch_size=args.batch_size, discount=args.discount)
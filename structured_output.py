@@ -0,0 +1,274 @@
+import re
+import json
+import argparse
+from pathlib import Path
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type, Union
+from jsonschema import Draft202012Validator
+from pydantic import BaseModel, ValidationError
+
+
+"""
+Shared structured-output handling for the LLM stages: parse model output as JSON, repair common breakage
+locally (trailing commas, unquoted keys, truncation), validate against a pydantic model or
+JSON Schema, and re-request only the items that still fail.
+"""
+
+# Counters per stage: calls, parsed, repaired.<kind>, invalid_items, retried_items, dropped_items, failed
+STATS = Counter()
+
+REPAIR_PROMPT = """
+The following JSON does not match the required schema.
+
+Errors:
+{errors}
+
+JSON:
+{item}
+
+Return only the corrected JSON, with the same content. No explanation.
+"""
+
+Schema = Union[Type[BaseModel], Dict]
+Retry = Callable[[str, List[str]], str]
+
+
+def make_validator(schema: Schema) -> Callable[[Any], List[str]]:
+    """Return a function that lists the validation errors of a value (empty when valid)."""
+    if isinstance(schema, type) and issubclass(schema, BaseModel):
+        def validate(value):
+            try:
+                schema.model_validate(value)
+                return []
+            except ValidationError as e:
+                return [f"{'.'.join(str(p) for p in err['loc']) or '$'}: {err['msg']}" for err in e.errors()]
+        return validate
+    validator = Draft202012Validator(schema)
+    return lambda value: [f"{'.'.join(str(p) for p in err.path) or '$'}: {err.message}" for err in validator.iter_errors(value)]
+
+
+def load_schema_file(path: str) -> Dict:
+    """Load a JSON Schema file, unwrapping the LlamaExtract-style {"data_schema": ...} envelope of story_schema.json."""
+    schema = json.loads(Path(path).read_text(encoding="utf-8"))
+    return schema.get("data_schema", schema)
+
+
+def _strip_fences(text: str) -> str:
+    match = re.search(r"```(?:json)?\s*(.*?)(?:```|$)", text, re.DOTALL)
+    return match.group(1) if match else text
+
+
+def _split_strings(text: str) -> List[Tuple[bool, str]]:
+    """Split text into (inside_string, part) pieces; an unterminated string runs to the end."""
+    parts = []
+    start = 0
+    in_string = False
+    escaped = False
+    for i, c in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif c == "\\":
+                escaped = True
+            elif c == '"':
+                parts.append((True, text[start:i + 1]))
+                start = i + 1
+                in_string = False
+        elif c == '"':
+            parts.append((False, text[start:i]))
+            start = i
+            in_string = True
+    parts.append((in_string, text[start:]))
+    return parts
+
+
+def _sub_outside_strings(pattern: str, replacement: str, text: str) -> str:
+    return "".join(part if inside else re.sub(pattern, replacement, part) for inside, part in _split_strings(text))
+
+
+def _remove_trailing_commas(text: str) -> str:
+    return _sub_outside_strings(r",\s*([\]}])", r"\1", text)
+
+
+def _quote_keys(text: str) -> str:
+    return _sub_outside_strings(r'([{,]\s*)([A-Za-z_][\w-]*)\s*:', r'\1"\2":', text)
+
+
+def _close_truncated(text: str) -> str:
+    """Cut back to the last complete element and close any brackets left open."""
+    stack = []
+    safe = None
+    offset = 0
+    parts = _split_strings(text)
+    for inside, part in parts:
+        if not inside:
+            for i, c in enumerate(part, offset):
+                if c in "[{":
+                    stack.append("]" if c == "[" else "}")
+                elif c in "]}" and stack:
+                    stack.pop()
+                    safe = (i + 1, list(stack))
+                elif c == "," and stack and stack[-1] == "]":
+                    safe = (i, list(stack))
+        offset += len(part)
+    unterminated = parts[-1][0]
+    if not stack and not unterminated:
+        return text
+    if safe is None:
+        raise ValueError("No complete JSON element to recover")
+    end, open_stack = safe
+    return _remove_trailing_commas(text[:end] + "".join(reversed(open_stack)))
+
+
+# Tried one at a time on the original text first, then stacked in this order
+REPAIRS = [
+    ("truncated", _close_truncated),
+    ("unquoted_keys", _quote_keys),
+    ("trailing_commas", _remove_trailing_commas),
+]
+
+DECODER = json.JSONDecoder()
+
+
+def repair_json(text: str) -> Tuple[Any, List[str]]:
+    """
+    Parse LLM output as JSON, trying each local repair on its own and then stacking them until it parses.
+    Repairs never touch the contents of JSON strings. Markdown fences, leading chatter and trailing text
+    after the JSON are ignored.
+
+    Returns:
+        tuple: The parsed value and the names of the repairs that were needed.
+    """
+    candidate = _strip_fences(text)
+    starts = [i for i in (candidate.find("["), candidate.find("{")) if i >= 0]
+    if not starts:
+        raise ValueError(f"No JSON found in output:\n\n{text}")
+    candidate = candidate[min(starts):]
+
+    attempts = [[]] + [[repair] for repair in REPAIRS] + [REPAIRS[:k] for k in range(2, len(REPAIRS) + 1)]
+    for repairs in attempts:
+        repaired = candidate
+        applied = []
+        try:
+            for name, repair in repairs:
+                fixed = repair(repaired)
+                if fixed != repaired:
+                    applied.append(name)
+                    repaired = fixed
+        except ValueError:
+            continue
+        if repairs and not applied:
+            continue
+        try:
+            value, _ = DECODER.raw_decode(repaired)
+            return value, applied
+        except json.JSONDecodeError:
+            continue
+    raise ValueError(f"Failed to parse JSON output:\n\n{text}")
+
+
+def _parse(text: str, stage: str, key: Optional[str]) -> Any:
+    value, applied = repair_json(text)
+    for name in applied:
+        STATS[f"{stage}.repaired.{name}"] += 1
+    if key and isinstance(value, dict) and key in value:
+        value = value[key]
+    return value
+
+
+def parse_structured(text: str, schema: Schema, stage: str, retry: Optional[Retry] = None,
+                     many: bool = False, key: Optional[str] = None, max_retries: int = 1) -> Any:
+    """
+    Parse and validate one LLM response.
+
+    Args:
+        text: Raw model output.
+        schema: Pydantic model or JSON Schema for one item (many=True) or for the whole value.
+        stage: Name the counters in STATS are recorded under.
+        retry: Called with (item JSON, errors) to re-request a single failing item; returns raw model output.
+        many: Expect a list of items (optionally under `key` in an object) and validate them one by one.
+        key: Object key holding the list when the model wraps it, e.g. "entities".
+        max_retries: Re-requests per failing item.
+
+    Returns:
+        The validated value, or the list of valid items when many=True (items that keep failing are dropped).
+    """
+    validate = make_validator(schema)
+    STATS[f"{stage}.calls"] += 1
+    try:
+        value = _parse(text, stage, key)
+    except ValueError:
+        STATS[f"{stage}.failed"] += 1
+        raise
+    STATS[f"{stage}.parsed"] += 1
+
+    if not many:
+        return _validate_item(value, validate, stage, retry, max_retries, required=True)
+
+    if isinstance(value, dict):
+        value = [value]
+    if not isinstance(value, list):
+        STATS[f"{stage}.failed"] += 1
+        raise ValueError(f"Expected a list of items, got {type(value).__name__}:\n\n{text}")
+    items = []
+    for item in value:
+        fixed = _validate_item(item, validate, stage, retry, max_retries, required=False)
+        if fixed is not None:
+            items.append(fixed)
+    return items
+
+
+def _validate_item(item: Any, validate, stage: str, retry: Optional[Retry], max_retries: int, required: bool):
+    errors = validate(item)
+    if not errors:
+        return item
+    STATS[f"{stage}.invalid_items"] += 1
+    retries = max_retries if retry else 0
+    for _ in range(retries):
+        STATS[f"{stage}.retried_items"] += 1
+        try:
+            item = _parse(retry(json.dumps(item, indent=2), errors), stage, None)
+        except ValueError:
+            continue
+        errors = validate(item)
+        if not errors:
+            return item
+    if required:
+        STATS[f"{stage}.failed"] += 1
+        raise ValueError(f"Output does not match schema after {retries} retries: {errors}")
+    STATS[f"{stage}.dropped_items"] += 1
+    print(f"[!] Dropping item that does not match schema: {errors}")
+    return None
+
+
+def llm_retry(llm) -> Retry:
+    """Build a retry callback that asks the LLM to fix a single item."""
+    def retry(item: str, errors: List[str]) -> str:
+        result = llm.invoke(REPAIR_PROMPT.format(errors="\n".join(errors), item=item))
+        return getattr(result, "content", result)
+    return retry
+
+
+def report_stats(path: Optional[str] = None):
+    """Print the structured-output counters, and append them as a JSON line to path if given."""
+    for name, count in sorted(STATS.items()):
+        print(f"[i] {name}: {count}")
+    if path:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(dict(STATS)) + "\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Repair and validate a JSON file against a JSON Schema.")
+    parser.add_argument("input", help="Path to JSON (or raw LLM output) to check")
+    parser.add_argument("--schema", "-s", default="story_schema.json", help="JSON Schema file")
+    parser.add_argument("--output", "-o", help="Write the repaired JSON here")
+    args = parser.parse_args()
+
+    value = parse_structured(Path(args.input).read_text(encoding="utf-8"), load_schema_file(args.schema), stage="file")
+    report_stats()
+    if args.output:
+        Path(args.output).write_text(json.dumps(value, indent=2), encoding="utf-8")
+        print(f"[✓] Repaired JSON written to {args.output}")
+    else:
+        print(json.dumps(value, indent=2))
@@ -0,0 +1,165 @@
+import json
+import hashlib
+import argparse
+from pathlib import Path
+from typing import Dict, List
+from langchain_ollama import OllamaLLM
+from langchain.prompts import PromptTemplate
+from prompt_packer import fit_text, get_budget, get_context_window, get_token_counter
+
+
+"""
+Build a hierarchical summary tree for a book: paragraph windows -> scenes -> chapters -> book.
+
+Every node is cached by the hash of its children, so editing one paragraph only re-summarizes the
+window containing it and the scene, chapter and book nodes above it.
+"""
+
+LEAF_PROMPT = """
+You are a literary assistant. Summarize the following passage from a novel in 2-3 sentences.
+Keep character names, places and what happens. Do not add anything that is not in the passage.
+
+--- BEGIN TEXT ---
+{text}
+--- END TEXT ---
+
+Only return the summary.
+"""
+
+ROLLUP_PROMPT = """
+You are a literary assistant. The following are consecutive summaries of parts of a {level} of a novel, in order.
+Combine them into one summary of the {level} in at most {sentences} sentences.
+Keep the main characters, places and events. Do not add anything that is not in the summaries.
+
+--- BEGIN SUMMARIES ---
+{text}
+--- END SUMMARIES ---
+
+Only return the summary.
+"""
+
+ROLLUP_SENTENCES = {"scene": 4, "chapter": 6, "book": 10}
+
+
+def node_key(level: str, model: str, parts: List[str]) -> str:
+    digest = hashlib.sha256(f"{model}:{level}".encode("utf-8"))
+    for part in parts:
+        digest.update(b"\0" + part.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def build_tree(book: Dict, model: str, leaf_size: int = 4, fanout: int = 4) -> List[Dict]:
+    """
+    Lay out the tree without summaries. Leaves cover leaf_size paragraphs, scenes cover fanout leaves.
+    Nodes are listed bottom-up, so every node comes after its children.
+    """
+    leaves, scenes, chapters = [], [], []
+    for chapter in book.get("chapters", []):
+        cid = f"CH{chapter['number']}"
+        paragraphs = chapter.get("paragraphs", [])
+        chapter_leaves = []
+        for w, start in enumerate(range(0, len(paragraphs), leaf_size)):
+            window = paragraphs[start:start + leaf_size]
+            chapter_leaves.append({
+                "id": f"{cid}_W{w}",
+                "level": "window",
+                "children": [f"{cid}_P{i}" for i in range(start, start + len(window))],
+                "text": "\n\n".join(window),
+                "key": node_key("window", model, window),
+            })
+        chapter_scenes = []
+        for s, start in enumerate(range(0, len(chapter_leaves), fanout)):
+            group = chapter_leaves[start:start + fanout]
+            chapter_scenes.append({
+                "id": f"{cid}_S{s}",
+                "level": "scene",
+                "children": [n["id"] for n in group],
+                "key": node_key("scene", model, [n["key"] for n in group]),
+            })
+        chapters.append({
+            "id": f"{cid}_SUM",
+            "level": "chapter",
+            "children": [n["id"] for n in chapter_scenes],
+            "key": node_key("chapter", model, [n["key"] for n in chapter_scenes]),
+        })
+        leaves.extend(chapter_leaves)
+        scenes.extend(chapter_scenes)
+    root = {
+        "id": "BOOK_SUM",
+        "level": "book",
+        "children": [n["id"] for n in chapters],
+        "key": node_key("book", model, [n["key"] for n in chapters]),
+    }
+    return leaves + scenes + chapters + [root]
+
+
+def summarize_tree(nodes: List[Dict], model: str, cache: Dict[str, str], concurrency: int = 4,
+                   context_tokens: int = None, reserve_tokens: int = None) -> List[Dict]:
+    """Fill in summaries level by level, sending each level's cache misses to the LLM concurrently."""
+    llm = OllamaLLM(model=model, temperature=0, num_ctx=get_context_window(model, context_tokens))
+    budget = get_budget(model, context_tokens, reserve_tokens)
+    count_tokens = get_token_counter(model)
+    leaf_prompt = PromptTemplate.from_template(LEAF_PROMPT)
+    rollup_prompt = PromptTemplate.from_template(ROLLUP_PROMPT)
+    by_id = {n["id"]: n for n in nodes}
+
+    for level in ("window", "scene", "chapter", "book"):
+        pending = [n for n in nodes if n["level"] == level and n["key"] not in cache]
+        prompts = []
+        for node in pending:
+            if level == "window":
+                overhead = count_tokens(leaf_prompt.format(text=""))
+                prompts.append(leaf_prompt.format(text=fit_text(node["text"], budget - overhead, count_tokens)))
+            else:
+                text = "\n\n".join(by_id[c]["summary"] for c in node["children"])
+                overhead = count_tokens(rollup_prompt.format(level=level, sentences=ROLLUP_SENTENCES[level], text=""))
+                prompts.append(rollup_prompt.format(level=level, sentences=ROLLUP_SENTENCES[level],
+                                                    text=fit_text(text, budget - overhead, count_tokens)))
+        print(f"[+] {level}: {len(pending)} to summarize, {sum(n['level'] == level for n in nodes) - len(pending)} cached")
+        if prompts:
+            for node, summary in zip(pending, llm.batch(prompts, config={"max_concurrency": concurrency})):
+                cache[node["key"]] = summary.strip()
+        for node in nodes:
+            if node["level"] == level:
+                node["summary"] = cache[node["key"]]
+
+    for node in nodes:
+        node.pop("text", None)
+    return nodes
+
+
+def build_summary_tree(book_path: str, output_path: str, model: str = "llama3.2", cache_path: str = None,
+                       leaf_size: int = 4, fanout: int = 4, concurrency: int = 4,
+                       context_tokens: int = None, reserve_tokens: int = None):
+    book = json.loads(Path(book_path).read_text(encoding="utf-8"))
+    cache_file = Path(cache_path) if cache_path else None
+    cache = json.loads(cache_file.read_text(encoding="utf-8")) if cache_file and cache_file.exists() else {}
+
+    nodes = build_tree(book, model, leaf_size=leaf_size, fanout=fanout)
+    try:
+        book["summary_tree"] = summarize_tree(nodes, model, cache, concurrency=concurrency,
+                                              context_tokens=context_tokens, reserve_tokens=reserve_tokens)
+    finally:
+        if cache_file:
+            cache_file.write_text(json.dumps(cache, indent=2), encoding="utf-8")
+
+    Path(output_path).write_text(json.dumps(book, indent=2), encoding="utf-8")
+    print(f"[✓] Book with summary tree written to {output_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a paragraph -> scene -> chapter -> book summary tree with Ollama.")
+    parser.add_argument("book", help="Path to book JSON with chapters and paragraphs")
+    parser.add_argument("--output", "-o", required=True, help="Output path for book with summary_tree")
+    parser.add_argument("--model", default="llama3.2", help="Ollama model to use")
+    parser.add_argument("--cache", help="Path to JSON cache of summaries keyed by node hash (reused across runs)")
+    parser.add_argument("--leaf-size", type=int, default=4, help="Paragraphs per leaf window")
+    parser.add_argument("--fanout", type=int, default=4, help="Leaf windows per scene")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent LLM requests per level")
+    parser.add_argument("--context-tokens", type=int, help="Override the model's context window (see prompt_packer.py)")
+    parser.add_argument("--reserve-tokens", type=int, help="Override the tokens reserved for the model's reply")
+    args = parser.parse_args()
+
+    build_summary_tree(args.book, args.output, model=args.model, cache_path=args.cache,
+                       leaf_size=args.leaf_size, fanout=args.fanout, concurrency=args.concurrency,
+                       context_tokens=args.context_tokens, reserve_tokens=args.reserve_tokens)
@@ -0,0 +1,66 @@
+import json
+import shutil
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("dotenv")
+pytest.importorskip("llama_index.core")
+pytest.importorskip("langchain_ollama")
+pytest.importorskip("pandas")  # MarkdownElementNodeParser
+
+import parse_with_llama_parse as plp
+from llama_index.core.llms import MockLLM
+
+
+EXAMPLE = Path(__file__).resolve().parent.parent / "examples" / "Chapter1.md"
+
+
+@pytest.fixture
+def offline(monkeypatch):
+    """Run the local backend without an Ollama server: the example has no tables, so the LLM is never called."""
+    monkeypatch.setattr(plp, "OllamaLLM", lambda model: MockLLM())
+    calls = []
+    parse_to_nodes = plp.parse_to_nodes
+
+    def counting(file_path, *args, **kwargs):
+        calls.append(Path(file_path))
+        return parse_to_nodes(file_path, *args, **kwargs)
+
+    monkeypatch.setattr(plp, "parse_to_nodes", counting)
+    return calls
+
+
+def read_jsonl(path):
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines() if line.strip()]
+
+
+def test_local_backend_resumes_and_replaces_changed_files(tmp_path, monkeypatch, offline):
+    chapter = tmp_path / "Chapter1.md"
+    shutil.copy(EXAMPLE, chapter)
+    output = tmp_path / "nodes.jsonl"
+    checkpoint = tmp_path / "nodes.jsonl.checkpoint.jsonl"
+
+    plp.ingest_batch([str(chapter)], str(output), backend="local", workers=1)
+    first = read_jsonl(output)
+    assert first
+    assert {r["source"] for r in first} == {str(chapter.resolve())}
+    assert len(read_jsonl(checkpoint)) == 1
+
+    # Unchanged file, given as a relative path from another cwd: skipped through the checkpoint
+    monkeypatch.chdir(tmp_path)
+    plp.ingest_batch(["Chapter1.md"], str(output), backend="local", workers=1)
+    assert len(offline) == 1
+    assert read_jsonl(output) == first
+
+    # Changed file: parsed again, and its old records are replaced rather than kept alongside
+    chapter.write_text(chapter.read_text(encoding="utf-8") + "\n\nA new closing paragraph.\n", encoding="utf-8")
+    plp.ingest_batch([str(chapter)], str(output), backend="local", workers=1)
+    assert len(offline) == 2
+    second = read_jsonl(output)
+    assert {r["source"] for r in second} == {str(chapter.resolve())}
+    assert any("A new closing paragraph." in json.dumps(r) for r in second)
+
+    fresh = tmp_path / "fresh.jsonl"
+    plp.ingest_batch([str(chapter)], str(fresh), backend="local", workers=1)
+    assert len(second) == len(read_jsonl(fresh))